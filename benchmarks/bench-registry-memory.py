@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+import argparse
+import gc
+import tracemalloc
+
+from sitemon.common import SiteStatus
+from sitemon.registry import SiteRegistry
+
+
+def _parse_args(args=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--sites",
+        type=int,
+        default=100_000,
+        help="number of monitored sites to register",
+    )
+    return parser.parse_args(args)
+
+
+def _measure(fn) -> int:
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        result = fn()
+        gc.collect()
+        after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return after - before
+
+
+def _fill_registry(count: int) -> SiteRegistry:
+    registry = SiteRegistry()
+    for i in range(count):
+        index = registry.add(
+            url=f"https://site-{i}.example.com/health",
+            interval_s=60,
+            match='OK' if i % 2 else '',
+            due_ms=i,
+        )
+        registry.set_status(index, 200, 0.25, True)
+    return registry
+
+
+def _make_statuses(count: int):
+    return [
+        SiteStatus(
+            url=f"https://site-{i}.example.com/health",
+            check_time_ns=1_577_836_800_000_000_000,
+            http_code=200,
+            latency_s=0.25,
+            match='OK' if i % 2 else '',
+            is_match_found=True,
+        )
+        for i in range(count)
+    ]
+
+
+def main():
+    """Report memory used per monitored site."""
+    info = _parse_args()
+    count = info.sites
+    registry_bytes = _measure(lambda: _fill_registry(count))
+    urls_bytes = _measure(
+        lambda: [f"https://site-{i}.example.com/health" for i in range(count)]
+    )
+    status_bytes = _measure(lambda: _make_statuses(count))
+    print(f"Sites: {count}")
+    print(f"SiteRegistry: {registry_bytes / count:.1f} bytes/site")
+    print(f"  of them URL strings: {urls_bytes / count:.1f} bytes/site")
+    print(f"  registry overhead: {(registry_bytes - urls_bytes) / count:.1f} bytes/site")
+    print(f"SiteStatus list, for comparison: {status_bytes / count:.1f} bytes/site")
+
+
+if __name__ == '__main__':
+    main()
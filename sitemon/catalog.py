@@ -0,0 +1,235 @@
+"""Sources of the monitored sites set and its incremental reload."""
+import asyncio
+import logging
+import os
+import random
+import time
+import typing
+
+from sitemon.common import (
+    CheckMode,
+    read_json_file,
+)
+from sitemon import db
+from sitemon.registry import (
+    NOT_SCHEDULED,
+    SiteRegistry,
+)
+
+
+_log = logging.getLogger(__name__)
+
+#: Default interval between checks of the sites source for changes, in seconds.
+DEFAULT_RELOAD_INTERVAL_S = 30.0
+
+
+#: Identity of the monitored site: URL and expression to search, the same
+#: URL can be monitored with different expressions.
+SiteKey = typing.Tuple[str, str]
+
+
+class SiteConfig(typing.NamedTuple):
+    """Check parameters of the monitored site."""
+
+    interval_s: float
+    check_mode: CheckMode
+
+
+def parse_sites(
+        sites: typing.Iterable[dict],
+        default_interval: float = 60,
+        default_check_mode: CheckMode = CheckMode.Get,
+) -> typing.Dict[SiteKey, SiteConfig]:
+    """
+    Parse sites descriptions in the sites file format.
+
+    :returns: site configuration by (url, match), only the first description
+        is used if the same site is described several times
+
+    """
+    configs: typing.Dict[SiteKey, SiteConfig] = {}
+    for site in sites:
+        key = (site['url'], site.get('match') or '')
+        if key in configs:
+            _log.warning("Site %s %r is described several times, using the first one", *key)
+            continue
+        configs[key] = SiteConfig(
+            interval_s=site.get('interval', default_interval),
+            check_mode=CheckMode(site.get('mode', default_check_mode)),
+        )
+    return configs
+
+
+def _monotonic_ms() -> int:
+    return time.monotonic_ns() // 1_000_000
+
+
+def _get_jitter_ms(interval_s: float) -> int:
+    return int(random.uniform(0, interval_s) * 1000)
+
+
+def apply_sites(
+        registry: SiteRegistry,
+        configs: typing.Mapping[SiteKey, SiteConfig],
+) -> typing.List[SiteKey]:
+    """
+    Make registry match `configs` changing only what is different.
+
+    Sites are identified by (url, match), so changed expression to search
+    means the site is removed and the new one is added. New sites are
+    scheduled at random moment within their check interval to avoid checking
+    them all at once. Removed sites are unscheduled. Sites with changed
+    interval or mode keep their index, status and schedule, except the next
+    check is moved earlier if the new interval is shorter.
+
+    :returns: removed sites
+
+    """
+    now_ms = _monotonic_ms()
+    added = updated = 0
+    removed = []
+    seen = set()
+    for index in list(registry.iter_indices()):
+        key = (registry.get_url(index), registry.get_match(index))
+        config = configs.get(key)
+        if config is None or key in seen:
+            registry.remove(index)
+            removed.append(key)
+            continue
+        seen.add(key)
+        if config == (registry.get_interval_s(index), registry.get_check_mode(index)):
+            continue
+        registry.update(index, *config)
+        updated += 1
+        due_ms = registry.get_due_ms(index)
+        latest_due_ms = now_ms + int(config.interval_s * 1000)
+        if due_ms != NOT_SCHEDULED and due_ms > latest_due_ms:
+            registry.schedule(index, now_ms + _get_jitter_ms(config.interval_s))
+
+    for (url, match), config in configs.items():
+        if (url, match) in seen:
+            continue
+        registry.add(
+            url=url,
+            interval_s=config.interval_s,
+            match=match,
+            due_ms=now_ms + _get_jitter_ms(config.interval_s),
+            check_mode=config.check_mode,
+        )
+        added += 1
+    if added or updated or removed:
+        _log.info("Sites added: %d, updated: %d, removed: %d", added, updated, len(removed))
+    return removed
+
+
+class SitesFile:  # pylint: disable=too-few-public-methods
+    """Sites set described in the JSON file, re-read when file is modified."""
+
+    def __init__(
+            self,
+            path: str,
+            default_interval: float = 60,
+            default_check_mode: CheckMode = CheckMode.Get,
+    ):
+        """
+        Create source of sites described in the file.
+
+        :param path: JSON file with sites, see `parse_sites()`
+        :param default_interval: check interval of sites without it, in seconds
+        :param default_check_mode: check mode of sites without it
+
+        """
+        self._path = path
+        self._default_interval = default_interval
+        self._default_check_mode = default_check_mode
+        self._mtime_ns: typing.Optional[int] = None
+
+    async def get_sites(self) -> typing.Optional[typing.Dict[SiteKey, SiteConfig]]:
+        """Return sites configuration or None if it was not changed."""
+        mtime_ns = os.stat(self._path).st_mtime_ns
+        if mtime_ns == self._mtime_ns:
+            return None
+        self._mtime_ns = mtime_ns
+        return parse_sites(
+            read_json_file(self._path)['sites'],
+            self._default_interval,
+            self._default_check_mode,
+        )
+
+
+class SitesDbCatalog:  # pylint: disable=too-few-public-methods
+    """Sites set marked to be monitored in the `site_info` database table."""
+
+    def __init__(
+            self,
+            dsn: db.Dsn,
+            default_interval: float = 60,
+            default_check_mode: CheckMode = CheckMode.Get,
+    ):
+        """
+        Create source of sites marked to be monitored in the database.
+
+        :param dsn: database with the `site_info` table
+        :param default_interval: check interval of sites without it, in seconds
+        :param default_check_mode: check mode of sites without it
+
+        """
+        self._dsn = dsn
+        self._default_interval = default_interval
+        self._default_check_mode = default_check_mode
+        self._sites: typing.Optional[typing.List[dict]] = None
+
+    async def get_sites(self) -> typing.Optional[typing.Dict[SiteKey, SiteConfig]]:
+        """Return sites configuration or None if it was not changed."""
+        async with db.connection_context(self._dsn) as connection:
+            sites = await db.SiteState(connection).get_monitored_sites()
+        if sites == self._sites:
+            return None
+        self._sites = sites
+        return parse_sites(sites, self._default_interval, self._default_check_mode)
+
+
+#: Source of the monitored sites set.
+SitesSource = typing.Union[SitesFile, SitesDbCatalog]
+
+
+async def reload_sites(
+        registry: SiteRegistry,
+        source: SitesSource,
+        on_removed: typing.Optional[typing.Callable] = None,
+):
+    """
+    Apply changes of the sites set to the registry.
+
+    :param on_removed: Coroutine called with URL and match of each removed
+        site to forget state kept for it outside of the registry
+
+    """
+    configs = await source.get_sites()
+    if configs is None:
+        return
+    for url, match in apply_sites(registry, configs):
+        if on_removed:
+            await on_removed(url, match)
+
+
+async def watch_sites(
+        registry: SiteRegistry,
+        source: SitesSource,
+        reload_interval_s: float = DEFAULT_RELOAD_INTERVAL_S,
+        on_removed: typing.Optional[typing.Callable] = None,
+):
+    """
+    Periodically apply changes of the sites set to the registry until cancelled.
+
+    Parameters are the same as for `reload_sites()` except:
+
+    :param reload_interval_s: interval between checks for changes, in seconds
+
+    """
+    while True:
+        await asyncio.sleep(reload_interval_s)
+        try:
+            await reload_sites(registry, source, on_removed)
+        except Exception:  # pylint: disable=broad-except
+            _log.exception("Failed to reload sites")
@@ -1,22 +1,49 @@
 """Contains functionality used by all modules."""
 
-from dataclasses import dataclass
+import argparse
+import datetime
+import enum
 import json
+import math
+import typing
 
 
 #: Topic used to pass monitored status Kafka messages.
 STATUS_TOPIC_NAME = 'sitemon.site.status'
 
+#: Topic used to pass heartbeats aggregating checks with unchanged status.
+HEARTBEAT_TOPIC_NAME = 'sitemon.site.heartbeat'
 
-@dataclass(frozen=True)
-class SiteStatus:
-    """Structure of the message representing monitored site status."""
+
+class CheckMode(str, enum.Enum):
+    """How the monitored site is requested."""
+
+    Get = 'get'
+    """Full GET request."""
+
+    Head = 'head'
+    """HEAD request, used only if there is no expression to search."""
+
+    Conditional = 'conditional'
+    """GET request with cached `ETag`/`Last-Modified` validators.
+
+    On 304 response search result of the previous full response is reused.
+    """
+
+
+class SiteStatus(typing.NamedTuple):
+    """
+    Structure of the message representing monitored site status.
+
+    Tuple-backed to keep per-check overhead low, use `_asdict()` to get
+    the message data.
+    """
 
     url: str
     """URL of the monitored web site."""
 
-    check_time_iso: str
-    """Date/time when HTTP(S) request was sent in ISO format."""
+    check_time_ns: int
+    """Date/time when HTTP(S) request was sent, UTC nanoseconds since epoch."""
 
     http_code: int
     """HTTP code of the response to the GET request."""
@@ -33,6 +60,91 @@ class SiteStatus:
     is_match_found: bool
     """Indicate was text corresponding to `match` found."""
 
+    loop_lag_s: typing.Optional[float] = None
+    """Maximal monitor event loop lag observed during check, in seconds.
+
+    None if monitor is not running in profiling mode.
+    """
+
+    schedule_delay_s: typing.Optional[float] = None
+    """Time between the moment check was due and the request, in seconds.
+
+    Includes waiting for the concurrency and rate limits, not included into
+    `latency_s`. None if check is not scheduled by the sites registry and
+    requests are not throttled.
+    """
+
+    check_mode: str = CheckMode.Get.value
+    """`CheckMode` value used to request the site."""
+
+
+class SiteHeartbeat(typing.NamedTuple):
+    """
+    Structure of the message aggregating checks suppressed in change-only mode.
+
+    Heartbeat covers all checks done between `first_check_time_ns` and
+    `last_check_time_ns` (inclusive) which have the same status as the last
+    published `SiteStatus` for the same `url` and `match`.
+    """
+
+    url: str
+    """URL of the monitored web site."""
+
+    match: str
+    """Regular expression searched within returned response."""
+
+    first_check_time_ns: int
+    """Date/time of the first aggregated check, UTC nanoseconds since epoch."""
+
+    last_check_time_ns: int
+    """Date/time of the last aggregated check, UTC nanoseconds since epoch."""
+
+    checks_count: int
+    """Number of aggregated checks."""
+
+    http_code: int
+    """HTTP code shared by all aggregated checks."""
+
+    is_match_found: bool
+    """Search result shared by all aggregated checks."""
+
+    latency_min_s: float
+    """Minimal latency of aggregated checks, in seconds."""
+
+    latency_max_s: float
+    """Maximal latency of aggregated checks, in seconds."""
+
+    latency_mean_s: float
+    """Mean latency of aggregated checks, in seconds."""
+
+
+def iso_to_ns(value: str) -> int:
+    """
+    Convert date/time in ISO format to UTC nanoseconds since epoch.
+
+    Date/time without timezone is treated as local time.
+    """
+    moment = datetime.datetime.fromisoformat(value).astimezone(datetime.timezone.utc)
+    delta = moment - datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+    return (delta.days * 86400 + delta.seconds) * 1_000_000_000 + delta.microseconds * 1000
+
+
+def parse_site_status(data: dict) -> SiteStatus:
+    """
+    Create site status from the message data.
+
+    Messages from older monitors with `check_time_iso` are also accepted.
+    """
+    if 'check_time_iso' in data:
+        data = dict(data)
+        data['check_time_ns'] = iso_to_ns(data.pop('check_time_iso'))
+    return SiteStatus(**data)
+
+
+def parse_site_heartbeat(data: dict) -> SiteHeartbeat:
+    """Create site heartbeat from the message data."""
+    return SiteHeartbeat(**data)
+
 
 def read_json_file(path: str) -> dict:
     """
@@ -42,3 +154,19 @@ def read_json_file(path: str) -> dict:
     """
     with open(path) as f:
         return json.load(f)
+
+
+def positive_int(value: str) -> int:
+    """Parse positive integer CLI argument, use as `type` of argparse argument."""
+    result = int(value)
+    if result < 1:
+        raise argparse.ArgumentTypeError(f"should be positive, got {value}")
+    return result
+
+
+def positive_float(value: str) -> float:
+    """Parse positive float CLI argument, use as `type` of argparse argument."""
+    result = float(value)
+    if math.isnan(result) or result <= 0:
+        raise argparse.ArgumentTypeError(f"should be positive, got {value}")
+    return result
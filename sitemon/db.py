@@ -2,7 +2,6 @@ import argparse
 import asyncio
 import contextlib
 from dataclasses import dataclass
-import datetime
 import logging
 import sys
 import typing
@@ -11,16 +10,35 @@ import asyncpg  # type: ignore
 
 from sitemon.common import (
     read_json_file,
+    SiteHeartbeat,
     SiteStatus,
 )
 
 
 _log = logging.getLogger(__name__)
 
+# previous versions of procedures take timestamptz instead of nanoseconds and
+# fewer status fields, drop them to keep a single version of each procedure
 _CREATE_INSERT_PROCEDURE = """
-create or replace procedure insert_status(
-    site_url text, match text, check_time timestamptz,
-    http_code integer, latency float, is_expression_found bool)
+drop procedure if exists insert_status(
+    text, text, timestamptz, integer, float, bool);
+drop procedure if exists insert_status(
+    text, text, timestamptz, integer, float, bool, float);
+drop procedure if exists insert_status(
+    text, text, timestamptz, integer, float, bool, float, float);
+drop procedure if exists insert_status(
+    text, text, timestamptz, integer, float, bool, float, float, text);
+drop procedure if exists insert_interval(
+    text, text, timestamptz, timestamptz, integer, integer, bool, float, float, float);
+
+create or replace function ns_to_timestamptz(time_ns bigint)
+returns timestamptz
+language sql immutable as $$
+    select timestamptz 'epoch' + (time_ns / 1000) * interval '1 microsecond';
+$$;
+
+create or replace function get_site_info_id(site_url text, match text)
+returns integer
 language plpgsql as $$
 declare
     info_id integer := null;
@@ -35,10 +53,40 @@ begin
         )
         select * from new_id into info_id;
     end if;
-    insert into site_state(site_info_id, check_time, http_code, latency, is_expression_found)
-        values (info_id, check_time, http_code, latency, is_expression_found);
+    return info_id;
 end;
-$$
+$$;
+
+create or replace procedure insert_status(
+    site_url text, match text, check_time_ns bigint,
+    http_code integer, latency float, is_expression_found bool,
+    loop_lag float, schedule_delay float, check_mode text)
+language plpgsql as $$
+begin
+    insert into site_state(
+        site_info_id, check_time, http_code, latency, is_expression_found,
+        loop_lag, schedule_delay, check_mode, record_time)
+        values (get_site_info_id(site_url, match),
+                ns_to_timestamptz(check_time_ns), http_code, latency, is_expression_found,
+                loop_lag, schedule_delay, check_mode, clock_timestamp());
+end;
+$$;
+
+create or replace procedure insert_interval(
+    site_url text, match text, begin_time_ns bigint, end_time_ns bigint,
+    checks_count integer, http_code integer, is_expression_found bool,
+    latency_min float, latency_max float, latency_mean float)
+language plpgsql as $$
+begin
+    insert into site_state_interval(
+        site_info_id, begin_time, end_time, checks_count, http_code, is_expression_found,
+        latency_min, latency_max, latency_mean)
+        values (get_site_info_id(site_url, match),
+                ns_to_timestamptz(begin_time_ns), ns_to_timestamptz(end_time_ns),
+                checks_count, http_code, is_expression_found,
+                latency_min, latency_max, latency_mean);
+end;
+$$;
 """
 
 # if information should be requested from the database, index should be created for the url field
@@ -61,6 +109,33 @@ create table site_state (
 );
 """
 
+# columns added after initial schema version
+_ALTER_TABLES_QUERY = """
+alter table site_state add column if not exists loop_lag float;
+alter table site_state add column if not exists schedule_delay float;
+alter table site_state add column if not exists check_mode text;
+alter table site_state add column if not exists record_time timestamptz;
+alter table site_info add column if not exists is_monitored bool not null default false;
+alter table site_info add column if not exists check_interval float;
+alter table site_info add column if not exists check_mode text;
+"""
+
+# separate from _CREATE_TABLES_QUERY to be added to already existing databases
+_CREATE_INTERVALS_TABLE_QUERY = """
+create table site_state_interval (
+    id bigserial unique,
+    site_info_id integer references site_info (id) not null,
+    begin_time timestamptz not null,
+    end_time timestamptz not null,
+    checks_count integer not null,
+    http_code integer not null,
+    is_expression_found bool,
+    latency_min float not null,
+    latency_max float not null,
+    latency_mean float not null
+);
+"""
+
 USER_DB_JSON_EXAMPLE = """
 {
     "user": "avnadmin",
@@ -143,6 +218,40 @@ async def connection_context(dsn: typing.Union[str, Dsn]) -> asyncpg.Connection:
         await connection.close()
 
 
+_INSERT_STATUS_QUERY = "call insert_status($1, $2, $3, $4, $5, $6, $7, $8, $9);"
+
+_INSERT_INTERVAL_QUERY = "call insert_interval($1, $2, $3, $4, $5, $6, $7, $8, $9, $10);"
+
+
+def _get_status_args(status: SiteStatus) -> tuple:
+    return (
+        status.url,
+        status.match,
+        status.check_time_ns,
+        status.http_code,
+        status.latency_s,
+        status.is_match_found,
+        status.loop_lag_s,
+        status.schedule_delay_s,
+        status.check_mode,
+    )
+
+
+def _get_heartbeat_args(heartbeat: SiteHeartbeat) -> tuple:
+    return (
+        heartbeat.url,
+        heartbeat.match,
+        heartbeat.first_check_time_ns,
+        heartbeat.last_check_time_ns,
+        heartbeat.checks_count,
+        heartbeat.http_code,
+        heartbeat.is_match_found,
+        heartbeat.latency_min_s,
+        heartbeat.latency_max_s,
+        heartbeat.latency_mean_s,
+    )
+
+
 @dataclass(frozen=True)
 class SiteState:
     """
@@ -158,27 +267,133 @@ class SiteState:
         Initialize database tables, stored procedures.
 
         Creates site monitor tables if they don't exist. Also create/replace
-        stored procedure, used to insert site status data.
+        stored procedures, used to insert site status data.
 
         """
-        try:
-            await self.connection.execute(_CREATE_TABLES_QUERY)
-        except asyncpg.exceptions.DuplicateTableError:
-            _log.debug("Tables already exist")
+        for query in (_CREATE_TABLES_QUERY, _CREATE_INTERVALS_TABLE_QUERY):
+            try:
+                await self.connection.execute(query)
+            except asyncpg.exceptions.DuplicateTableError:
+                _log.debug("Tables already exist")
 
+        await self.connection.execute(_ALTER_TABLES_QUERY)
         await self.connection.execute(_CREATE_INSERT_PROCEDURE)
 
     async def insert_site_status(self, status: SiteStatus):
         """Save site status to the database tables."""
-        await self.connection.execute(
-            "call insert_status($1, $2, $3, $4, $5, $6);",
-            status.url,
-            status.match,
-            datetime.datetime.fromisoformat(status.check_time_iso),
-            status.http_code,
-            status.latency_s,
-            status.is_match_found,
+        await self.connection.execute(_INSERT_STATUS_QUERY, *_get_status_args(status))
+
+    async def insert_site_statuses(self, statuses: typing.Iterable[SiteStatus]):
+        """Save batch of site statuses to the database tables."""
+        async with self.connection.transaction():
+            await self.connection.executemany(
+                _INSERT_STATUS_QUERY, [_get_status_args(status) for status in statuses],
+            )
+
+    async def insert_site_heartbeat(self, heartbeat: SiteHeartbeat):
+        """Save interval of checks with unchanged site status to the database."""
+        await self.connection.execute(_INSERT_INTERVAL_QUERY, *_get_heartbeat_args(heartbeat))
+
+    async def insert_site_heartbeats(self, heartbeats: typing.Iterable[SiteHeartbeat]):
+        """Save batch of intervals with unchanged site status to the database."""
+        async with self.connection.transaction():
+            await self.connection.executemany(
+                _INSERT_INTERVAL_QUERY,
+                [_get_heartbeat_args(heartbeat) for heartbeat in heartbeats],
+            )
+
+    async def get_monitored_sites(self) -> typing.List[dict]:
+        """
+        Return catalog of sites marked to be monitored in `site_info` table.
+
+        Items have the same format as sites in the monitor sites file.
+        """
+        records = await self.connection.fetch(
+            "select url, search_expression, check_interval, check_mode from site_info"
+            " where is_monitored order by id"
         )
+        sites = []
+        for record in records:
+            site = {'url': record['url'], 'match': record['search_expression']}
+            if record['check_interval'] is not None:
+                site['interval'] = record['check_interval']
+            if record['check_mode'] is not None:
+                site['mode'] = record['check_mode']
+            sites.append(site)
+        return sites
+
+    async def get_record_stats(
+            self,
+            url_pattern: str,
+            after_id: int,
+            begin_ns: int,
+            end_ns: int,
+    ) -> asyncpg.Record:
+        """
+        Return statistics of recording site statuses checked in the time range.
+
+        :param url_pattern: SQL LIKE pattern of the site URLs
+        :param after_id: only states recorded after the one with this ID are
+            counted, see `get_last_state_id()`
+        :param begin_ns: beginning of the check time range, UTC nanoseconds since epoch
+        :param end_ns: end of the check time range (exclusive)
+        :returns: record with `rows` count, `last_record_s` - UTC seconds since
+            epoch when the last row was recorded, `lag_s` - array of 50, 90
+            and 99 percentiles of the time between check and recording,
+            `max_lag_s` - maximal lag
+
+        """
+        return await self.connection.fetchrow(
+            """
+            with lags as (
+                select record_time, extract(epoch from record_time - check_time)::float8 as lag
+                from site_state, site_info
+                where site_state.id > $2
+                    and site_state.site_info_id = site_info.id and site_info.url like $1
+                    and check_time >= ns_to_timestamptz($3)
+                    and check_time < ns_to_timestamptz($4)
+            )
+            select count(*) as rows,
+                extract(epoch from max(record_time))::float8 as last_record_s,
+                percentile_cont(array[0.5, 0.9, 0.99]) within group (order by lag) as lag_s,
+                max(lag) as max_lag_s
+            from lags
+            """,
+            url_pattern,
+            after_id,
+            begin_ns,
+            end_ns,
+        )
+
+    async def get_last_state_id(self) -> int:
+        """Return ID of the last recorded site state or 0 if there are no states."""
+        return await self.connection.fetchval("select coalesce(max(id), 0) from site_state")
+
+    async def get_time_ns(self) -> int:
+        """Return database server time, UTC nanoseconds since epoch with microsecond precision."""
+        return await self.connection.fetchval(
+            "select (extract(epoch from clock_timestamp()) * 1000000)::int8 * 1000"
+        )
+
+    async def delete_sites(self, url_pattern: str):
+        """
+        Delete sites and all their recorded states.
+
+        :param url_pattern: SQL LIKE pattern of the site URLs
+
+        """
+        async with self.connection.transaction():
+            await self.connection.execute(
+                "delete from site_state where site_info_id in"
+                " (select id from site_info where url like $1)",
+                url_pattern,
+            )
+            await self.connection.execute(
+                "delete from site_state_interval where site_info_id in"
+                " (select id from site_info where url like $1)",
+                url_pattern,
+            )
+            await self.connection.execute("delete from site_info where url like $1", url_pattern)
 
     async def gen_url_state(self, url: str):
         """Extract all records for the site state."""
@@ -191,11 +406,11 @@ class SiteState:
                 yield record
 
 
-def add_db_conn_argument(parser: argparse.ArgumentParser):
+def add_db_conn_argument(parser: argparse.ArgumentParser, required: bool = True):
     """Add documented DB connection JSON parameter to ArgumentParser."""
     parser.add_argument(
         "--db-conn",
-        required=True,
+        required=required,
         help=(
             "JSON file describing PostgreSQL DB connection in the format:\n\n"
             + _DB_CONN_JSON_EXAMPLE
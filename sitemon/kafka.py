@@ -106,10 +106,10 @@ class Server:
             **self.as_kwargs(),
         )
 
-    def get_consumer(self, topic: str):
-        """Create consumer based on the metadata."""
+    def get_consumer(self, *topics: str):
+        """Create consumer subscribed to `topics` based on the metadata."""
         return AIOKafkaConsumer(
-            topic,
+            *topics,
             loop=asyncio.get_event_loop(),
             value_deserializer=_deserialize,
             **self.as_kwargs(),
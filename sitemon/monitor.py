@@ -1,20 +1,38 @@
 import argparse
 import asyncio
-from dataclasses import asdict
-import datetime
+import bisect
+import contextlib
+from dataclasses import dataclass, field
 import enum
 import logging
 import re
+import time
 import typing
+import urllib.parse
 
 import httpx
 
 from sitemon.common import (
+    CheckMode,
+    HEARTBEAT_TOPIC_NAME,
+    positive_float,
+    positive_int,
     read_json_file,
+    SiteHeartbeat,
     SiteStatus,
     STATUS_TOPIC_NAME,
 )
-from sitemon import kafka
+from sitemon import (
+    catalog,
+    db,
+    kafka,
+    profiling,
+)
+from sitemon.registry import SiteRegistry
+from sitemon.throttle import (
+    DEFAULT_MAX_PER_HOST,
+    RequestThrottle,
+)
 
 
 _log = logging.getLogger(__name__)
@@ -27,20 +45,227 @@ class AuxHttpCode(enum.IntEnum):
     These codes are chosen to be compatible with ones used by Cloudflare.
     """
 
+    Unknown = 520
+    """Request failed without response, e.g. connection was reset."""
+
     Down = 521
+    """Connection was refused or host can't be resolved."""
+
+    ConnectionTimeout = 522
+    """Connection was not established in time."""
+
+    Timeout = 524
+    """Connection was established but response was not received in time."""
+
+
+#: Upper bounds of latency buckets, in seconds. Moving between buckets is
+#: treated as a status change in change-only mode.
+DEFAULT_LATENCY_BUCKETS_S = (0.1, 0.3, 1.0, 3.0, 10.0)
+
+#: Default maximal interval between heartbeats in change-only mode, in seconds.
+DEFAULT_HEARTBEAT_INTERVAL_S = 600.0
+
+#: Default maximal number of site checks running simultaneously.
+DEFAULT_MAX_CONCURRENT_CHECKS = 100
+
+# responses to HEAD request meaning server supports only GET
+_HEAD_NOT_SUPPORTED_CODES = frozenset((
+    httpx.codes.METHOD_NOT_ALLOWED,
+    httpx.codes.NOT_IMPLEMENTED,
+))
+
+# maximal time to wait for the next due check
+_MAX_IDLE_S = 1.0
+
+_SITES_JSON_EXAMPLE = """
+{
+    "sites": [
+        {"url": "https://example.com", "interval": 60, "match": "Example"},
+        {"url": "https://example.org", "mode": "head"}
+    ]
+}
+"""
+
+
+def _time_ns() -> int:
+    """Return UTC time in nanoseconds since epoch, easier to mock."""
+    return time.time_ns()
+
+
+def _monotonic_ns() -> int:
+    """Return monotonic clock value in nanoseconds, easier to mock."""
+    return time.monotonic_ns()
+
+
+def _monotonic_ms() -> int:
+    """Return monotonic clock value in milliseconds."""
+    return _monotonic_ns() // 1_000_000
+
+
+class _Validators(typing.NamedTuple):
+    etag: typing.Optional[str]
+    last_modified: typing.Optional[str]
+    is_match_found: bool
+
+
+class ConditionalCache:
+    """Cache of response validators for checks in `CheckMode.Conditional` mode."""
+
+    def __init__(self):
+        """Create empty cache."""
+        self._validators: typing.Dict[typing.Tuple[str, str], _Validators] = {}
+
+    def get(self, url: str, match: str) -> typing.Optional[_Validators]:
+        """Return cached validators of the site response."""
+        return self._validators.get((url, match))
 
+    def set(self, url: str, match: str, validators: _Validators):
+        """Cache validators of the site response."""
+        self._validators[(url, match)] = validators
 
-def _now():
-    """Make easier to mock now()."""
-    return datetime.datetime.now()
+    def discard(self, url: str, match: str):
+        """Forget cached validators of the site response."""
+        self._validators.pop((url, match), None)
 
 
-async def monitor_and_publish(
+@dataclass
+class CheckContext:
+    """Collaborators shared by checks of all sites."""
+
+    http_head_async: typing.Optional[typing.Callable] = None
+    """Coroutine to send HTTP(S) HEAD request, GET is used instead of HEAD if not provided."""
+
+    throttle: typing.Optional[RequestThrottle] = None
+    """If provided, request is sent when throttle permits it."""
+
+    lag_monitor: typing.Optional[profiling.LoopLagMonitor] = None
+    """If provided, statuses are annotated with event loop lag."""
+
+    conditional_cache: ConditionalCache = field(default_factory=ConditionalCache)
+    """Validators for conditional GET requests."""
+
+    head_unsupported: typing.Set[str] = field(default_factory=set)
+    """URLs of sites which rejected HEAD request with 405 or 501, GET is used for them."""
+
+    on_forget: typing.Optional[typing.Callable] = None
+    """Coroutine called with URL and match of the forgotten site to drop state kept elsewhere."""
+
+    async def forget(self, url: str, match: str):
+        """Drop state kept for the site, e.g. when it is removed from the monitored ones."""
+        self.conditional_cache.discard(url, match)
+        if not match:
+            self.head_unsupported.discard(url)
+        if self.on_forget:
+            await self.on_forget(url, match)
+
+
+def _get_check_mode(
+        context: CheckContext,
+        url: str,
+        match: str,
+        check_mode: CheckMode,
+) -> CheckMode:
+    if check_mode == CheckMode.Head and (
+            match
+            or context.http_head_async is None
+            or url in context.head_unsupported
+    ):
+        return CheckMode.Get
+    return check_mode
+
+
+async def _request_conditional(
+        http_get_async: typing.Callable,
+        conditional_cache: ConditionalCache,
+        url: str,
+        match: str,
+):
+    cached = conditional_cache.get(url, match)
+    headers = {}
+    if cached and cached.etag:
+        headers['If-None-Match'] = cached.etag
+    if cached and cached.last_modified:
+        headers['If-Modified-Since'] = cached.last_modified
+    response = await (http_get_async(url, headers=headers) if headers else http_get_async(url))
+    if response.status_code == httpx.codes.NOT_MODIFIED and cached:
+        return response, cached.is_match_found
+
+    is_match_found = not match or re.search(match, response.text) is not None
+    etag = response.headers.get('etag')
+    last_modified = response.headers.get('last-modified')
+    if 200 <= response.status_code < 300 and (etag or last_modified):
+        conditional_cache.set(url, match, _Validators(etag, last_modified, is_match_found))
+    else:
+        conditional_cache.discard(url, match)
+    return response, is_match_found
+
+
+async def _request_status(
+        http_get_async: typing.Callable,
+        context: CheckContext,
+        url: str,
+        match: str,
+        check_mode: CheckMode,
+) -> typing.Tuple[int, bool, float, CheckMode]:
+    is_match_found = False
+    try:
+        if check_mode == CheckMode.Head:
+            assert context.http_head_async is not None
+            response = await context.http_head_async(url)
+            if response.status_code in _HEAD_NOT_SUPPORTED_CODES:
+                _log.info("HEAD is not supported by %s, using GET", url)
+                context.head_unsupported.add(url)
+                check_mode = CheckMode.Get
+                response = await http_get_async(url)
+            is_match_found = True
+        elif check_mode == CheckMode.Conditional:
+            response, is_match_found = await _request_conditional(
+                http_get_async, context.conditional_cache, url, match,
+            )
+        else:
+            response = await http_get_async(url)
+            is_match_found = (
+                not match
+                or re.search(match, response.text) is not None
+            )
+        status_code = response.status_code
+        latency_s = response.elapsed.total_seconds()
+    except httpx.ConnectError:
+        status_code = AuxHttpCode.Down
+        latency_s = -1
+    except httpx.ConnectTimeout:
+        status_code = AuxHttpCode.ConnectionTimeout
+        latency_s = -1
+    except httpx.TimeoutException:
+        status_code = AuxHttpCode.Timeout
+        latency_s = -1
+    except httpx.TransportError:
+        status_code = AuxHttpCode.Unknown
+        latency_s = -1
+    return int(status_code), is_match_found, latency_s, check_mode
+
+
+@contextlib.asynccontextmanager
+async def _request_slot(
+        throttle: typing.Optional[RequestThrottle],
+        url: str,
+) -> typing.AsyncIterator[typing.Optional[float]]:
+    if throttle is None:
+        yield None
+        return
+    async with throttle.slot(urllib.parse.urlsplit(url).netloc) as wait_s:
+        yield wait_s
+
+
+async def monitor_and_publish(  # pylint: disable=too-many-arguments
         send_async: typing.Callable,
         http_get_async: typing.Callable,
         url: str,
         match: typing.Optional[str] = None,
-) -> datetime.datetime:
+        check_mode: CheckMode = CheckMode.Get,
+        context: typing.Optional[CheckContext] = None,
+        due_ns: typing.Optional[int] = None,
+) -> int:
     """
     Monitor web site and publish metrics.
 
@@ -48,57 +273,459 @@ async def monitor_and_publish(
     :param http_get_async: Corouting to send HTTP(S) GET request.
     :param url: monitored site URL;
     :param match: optional regular expression to search in the response text.
-    :returns: moment when check began
+    :param check_mode: how to request the site, GET is used if HEAD can't be
+        applied: with `match`, without `context.http_head_async` or rejected
+        by the server
+    :param context: collaborators shared by checks of all sites, time spent
+        waiting for `context.throttle` is reported as `schedule_delay_s` if
+        `due_ns` is not provided
+    :param due_ns: monotonic clock value when check was due, in nanoseconds;
+        if provided, time passed since it is reported as `schedule_delay_s`
+    :returns: monotonic clock value when check began, in nanoseconds
 
     """
-    start_time = _now()
-    is_match_found = False
-    try:
-        response = await http_get_async(url)
-        status_code = response.status_code
-        is_match_found = (
-            not match
-            or re.search(match, response.text) is not None
+    match = match or ''
+    context = context or CheckContext()
+    check_mode = _get_check_mode(context, url, match, check_mode)
+    lag_mark = context.lag_monitor.get_mark() if context.lag_monitor else 0
+    async with _request_slot(context.throttle, url) as schedule_delay_s:
+        start_ns = _monotonic_ns()
+        check_time_ns = _time_ns()
+        status_code, is_match_found, latency_s, check_mode = await _request_status(
+            http_get_async, context, url, match, check_mode,
         )
-        latency_s = response.elapsed.total_seconds()
-    except httpx.ConnectError:
-        status_code = AuxHttpCode.Down
-        latency_s = -1
+    if due_ns is not None:
+        schedule_delay_s = max(start_ns - due_ns, 0) / 1e9
 
     msg = SiteStatus(
         url=url,
-        http_code=int(status_code),
-        match=match or '',
+        http_code=status_code,
+        match=match,
         is_match_found=is_match_found,
-        check_time_iso=start_time.isoformat(),
+        check_time_ns=check_time_ns,
         latency_s=latency_s,
+        loop_lag_s=context.lag_monitor.get_max_lag_s(lag_mark) if context.lag_monitor else None,
+        schedule_delay_s=schedule_delay_s,
+        check_mode=check_mode.value,
     )
-    await send_async(STATUS_TOPIC_NAME, asdict(msg))
-    return start_time
+    await send_async(STATUS_TOPIC_NAME, msg._asdict())
+    return start_ns
+
+
+@dataclass
+class _SuppressedChecks:  # pylint: disable=too-many-instance-attributes
+    """Aggregated info about checks not published by `ChangeOnlyPublisher`."""
+
+    state: tuple
+    period_start_ns: int
+    http_code: int
+    is_match_found: bool
+    first_check_time_ns: int = 0
+    last_check_time_ns: int = 0
+    checks_count: int = 0
+    latency_min_s: float = 0
+    latency_max_s: float = 0
+    latency_sum_s: float = 0
+
+    def add(self, status: SiteStatus):
+        """Account suppressed check."""
+        if not self.checks_count:
+            self.first_check_time_ns = status.check_time_ns
+            self.latency_min_s = status.latency_s
+            self.latency_max_s = status.latency_s
+        else:
+            self.latency_min_s = min(self.latency_min_s, status.latency_s)
+            self.latency_max_s = max(self.latency_max_s, status.latency_s)
+        self.last_check_time_ns = status.check_time_ns
+        self.checks_count += 1
+        self.latency_sum_s += status.latency_s
+
+    def pop_heartbeat(self, url: str, match: str) -> SiteHeartbeat:
+        """Return heartbeat for accumulated checks and start new period."""
+        heartbeat = SiteHeartbeat(
+            url=url,
+            match=match,
+            first_check_time_ns=self.first_check_time_ns,
+            last_check_time_ns=self.last_check_time_ns,
+            checks_count=self.checks_count,
+            http_code=self.http_code,
+            is_match_found=self.is_match_found,
+            latency_min_s=self.latency_min_s,
+            latency_max_s=self.latency_max_s,
+            latency_mean_s=self.latency_sum_s / self.checks_count,
+        )
+        self.period_start_ns = self.last_check_time_ns
+        self.checks_count = 0
+        self.latency_sum_s = 0
+        return heartbeat
+
+
+class ChangeOnlyPublisher:
+    """
+    Publish site status transitions and periodic heartbeats only.
+
+    Wraps `send_async` passed to `monitor_and_publish()`. Status is published
+    only if `http_code`, `is_match_found` or latency bucket has changed since
+    the previous check of the same `url` and `match`. Suppressed checks are
+    aggregated into `SiteHeartbeat` published to `HEARTBEAT_TOPIC_NAME` at
+    least every `heartbeat_interval_s` and before the next transition, so
+    every check is accounted either by a status or by a heartbeat.
+    """
+
+    def __init__(
+            self,
+            send_async: typing.Callable,
+            heartbeat_interval_s: float = DEFAULT_HEARTBEAT_INTERVAL_S,
+            latency_buckets_s: typing.Sequence[float] = DEFAULT_LATENCY_BUCKETS_S,
+    ):
+        """
+        Create publisher.
+
+        :param send_async: Coroutine publishing message to the provided topic.
+        :param heartbeat_interval_s: maximal interval between heartbeats, in seconds
+        :param latency_buckets_s: upper bounds of latency buckets, in seconds
+
+        """
+        self._send_async = send_async
+        self._heartbeat_interval_s = heartbeat_interval_s
+        self._latency_buckets_s = sorted(latency_buckets_s)
+        self._sites: typing.Dict[typing.Tuple[str, str], _SuppressedChecks] = {}
+
+    def _get_state(self, status: SiteStatus) -> tuple:
+        return (
+            status.http_code,
+            status.is_match_found,
+            bisect.bisect_left(self._latency_buckets_s, status.latency_s),
+        )
+
+    async def send(self, topic: str, data: dict):
+        """Publish status if it differs from the previous one, aggregate otherwise."""
+        if topic != STATUS_TOPIC_NAME:
+            await self._send_async(topic, data)
+            return
+
+        status = SiteStatus(**data)
+        key = (status.url, status.match)
+        state = self._get_state(status)
+        suppressed = self._sites.get(key)
+        if suppressed is not None and suppressed.state == state:
+            suppressed.add(status)
+            time_passed_s = (status.check_time_ns - suppressed.period_start_ns) / 1e9
+            if time_passed_s >= self._heartbeat_interval_s:
+                await self._send_heartbeat(key, suppressed)
+            return
+
+        if suppressed is not None and suppressed.checks_count:
+            await self._send_heartbeat(key, suppressed)
+        self._sites[key] = _SuppressedChecks(
+            state=state,
+            period_start_ns=status.check_time_ns,
+            http_code=status.http_code,
+            is_match_found=status.is_match_found,
+        )
+        await self._send_async(topic, data)
+
+    async def discard(self, url: str, match: str):
+        """Publish heartbeat for checks of the site suppressed so far and forget it."""
+        suppressed = self._sites.pop((url, match), None)
+        if suppressed is not None and suppressed.checks_count:
+            await self._send_heartbeat((url, match), suppressed)
+
+    async def flush(self):
+        """Publish heartbeats for all checks suppressed so far."""
+        for key, suppressed in self._sites.items():
+            if suppressed.checks_count:
+                await self._send_heartbeat(key, suppressed)
+
+    async def _send_heartbeat(self, key: typing.Tuple[str, str], suppressed: _SuppressedChecks):
+        heartbeat = suppressed.pop_heartbeat(*key)
+        await self._send_async(HEARTBEAT_TOPIC_NAME, heartbeat._asdict())
 
 
 async def _wait_until_passed(
         check_interval_s: float,
-        start_time: datetime.datetime,
+        start_ns: int,
 ) -> None:
-    done_time = _now()
-    time_passed_s = (done_time - start_time).total_seconds()
-    if time_passed_s < 0:
-        _log.warning("Maybe clock was changed")
-        return
+    time_passed_s = (_monotonic_ns() - start_ns) / 1e9
     sleep_interval_s = check_interval_s - time_passed_s
     if sleep_interval_s > 0:
         _log.debug('Waiting for %d s till the next check', sleep_interval_s)
         await asyncio.sleep(sleep_interval_s)
 
 
+async def run_checks(
+        registry: SiteRegistry,
+        send_async: typing.Callable,
+        http_get_async: typing.Callable,
+        context: typing.Optional[CheckContext] = None,
+        is_stop_loop: typing.Callable = lambda: False,
+):
+    """
+    Check registered sites when they are due.
+
+    :param registry: monitored sites
+    :param send_async: Coroutine publishing site check results to the provided topic.
+    :param http_get_async: Coroutine to send HTTP(S) GET request.
+    :param context: collaborators shared by checks, checks concurrency is
+        limited only by `context.throttle`, so checks waiting for a busy host
+        don't prevent checks of other hosts from starting; sites removed from
+        registry while being checked are forgotten by `context.forget()`
+    :param is_stop_loop: function returning True to stop loop after the
+        current batch of due checks is done
+
+    Time between the moment check was due and the request is reported as
+    `schedule_delay_s`.
+    """
+    context = context or CheckContext()
+    wakeup = asyncio.Event()
+    tasks: typing.Set[asyncio.Task] = set()
+    # sites added before the start are due not earlier than the start
+    start_ms = _monotonic_ms()
+
+    async def check_site(index: int, due_ms: int, context: CheckContext):
+        generation = registry.get_generation(index)
+        # strings of the site removed during check can be reused by other sites
+        url = registry.get_url(index)
+        match = registry.get_match(index)
+
+        async def send_and_record(topic: str, data: dict):
+            if registry.get_generation(index) == generation:
+                registry.set_status(
+                    index, data['http_code'], data['latency_s'], data['is_match_found'],
+                )
+            await send_async(topic, data)
+
+        check_start_ms = _monotonic_ms()
+        try:
+            await monitor_and_publish(
+                send_async=send_and_record,
+                http_get_async=http_get_async,
+                url=url,
+                match=match,
+                check_mode=registry.get_check_mode(index),
+                context=context,
+                due_ns=due_ms * 1_000_000,
+            )
+        except Exception:  # pylint: disable=broad-except
+            _log.exception("Failed to check %s", url)
+        # site could be removed while being checked
+        if registry.get_generation(index) == generation:
+            registry.schedule(index, check_start_ms + int(registry.get_interval_s(index) * 1000))
+        else:
+            await context.forget(url, match)
+
+    def on_check_done(task: asyncio.Task):
+        tasks.discard(task)
+        wakeup.set()
+
+    while True:
+        for index, due_ms in registry.pop_due_with_time(_monotonic_ms()):
+            task = asyncio.create_task(check_site(index, max(due_ms, start_ms), context))
+            tasks.add(task)
+            task.add_done_callback(on_check_done)
+        if is_stop_loop():
+            break
+        next_due_ms = registry.get_next_due_ms()
+        wait_s = (
+            _MAX_IDLE_S if next_due_ms is None
+            else min(_MAX_IDLE_S, (next_due_ms - _monotonic_ms()) / 1000)
+        )
+        if wait_s > 0:
+            wakeup.clear()
+            try:
+                await asyncio.wait_for(wakeup.wait(), wait_s)
+            except asyncio.TimeoutError:
+                pass
+    if tasks:
+        await asyncio.wait(tasks)
+
+
+@dataclass(frozen=True)
+class MonitorOptions:
+    """Options of monitoring sites from registry."""
+
+    change_only: bool = False
+    """Publish only status transitions and heartbeats."""
+
+    heartbeat_interval_s: float = DEFAULT_HEARTBEAT_INTERVAL_S
+    """Maximal interval between heartbeats in change-only mode, in seconds."""
+
+    max_concurrent_checks: int = DEFAULT_MAX_CONCURRENT_CHECKS
+    """Maximal number of checks running simultaneously and HTTP connections."""
+
+    throttle: typing.Optional[RequestThrottle] = None
+    """Requests rate and per host concurrency limits, only concurrency is limited by default."""
+
+    profile: typing.Optional[profiling.ProfileOptions] = None
+    """Profiling mode options or None if profiling is off."""
+
+    sites_source: typing.Optional[catalog.SitesSource] = None
+    """If provided, sites are loaded to registry from it."""
+
+    reload_interval_s: float = catalog.DEFAULT_RELOAD_INTERVAL_S
+    """Interval between checks of `sites_source` for changes, in seconds; 0 to load once."""
+
+
+def add_monitor_arguments(parser: argparse.ArgumentParser):
+    """Add monitored sites and checks parameters to ArgumentParser."""
+    sites_group = parser.add_mutually_exclusive_group(required=True)
+    sites_group.add_argument("--url", type=str)
+    sites_group.add_argument(
+        "--sites",
+        help=(
+            "JSON file describing monitored sites in the format:\n\n"
+            + _SITES_JSON_EXAMPLE
+        ),
+    )
+    sites_group.add_argument(
+        "--sites-db",
+        help=(
+            "JSON file with DB containing catalog of monitored sites"
+            " (site_info rows with is_monitored set), requires --db-conn:\n\n"
+            + db.USER_DB_JSON_EXAMPLE
+        ),
+    )
+    parser.add_argument(
+        "--reload-interval",
+        type=float,
+        default=catalog.DEFAULT_RELOAD_INTERVAL_S,
+        help=(
+            "interval between checks of --sites or --sites-db for changes, in seconds;"
+            " 0 to disable reload"
+        ),
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=60,
+        help="interval between checks, used by default for sites from --sites or --sites-db",
+    )
+    parser.add_argument("--match")
+    parser.add_argument(
+        "--check-mode",
+        type=CheckMode,
+        choices=list(CheckMode),
+        default=CheckMode.Get,
+        help=(
+            "how to request sites: 'head' - HEAD request if there is no --match,"
+            " 'conditional' - GET reusing the previous result if page is not modified;"
+            " used by default for sites from --sites or --sites-db"
+        ),
+    )
+    parser.add_argument(
+        "--max-concurrent-checks",
+        type=positive_int,
+        default=DEFAULT_MAX_CONCURRENT_CHECKS,
+        help="maximal number of site checks running simultaneously",
+    )
+    parser.add_argument(
+        "--max-per-host",
+        type=positive_int,
+        default=DEFAULT_MAX_PER_HOST,
+        help="maximal number of simultaneous requests to the same host",
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=positive_float,
+        help="maximal number of requests per second, not limited by default",
+    )
+    parser.add_argument(
+        "--rate-burst",
+        type=positive_int,
+        default=1,
+        help="number of requests which can be sent at once if rate is limited",
+    )
+    parser.add_argument(
+        "--change-only",
+        action="store_true",
+        help="publish only status transitions and periodic heartbeats",
+    )
+    parser.add_argument(
+        "--heartbeat-interval",
+        type=float,
+        default=DEFAULT_HEARTBEAT_INTERVAL_S,
+        help="maximal interval between heartbeats in change-only mode, in seconds",
+    )
+    profiling.add_profile_arguments(parser)
+
+
+def create_registry(args: argparse.Namespace) -> SiteRegistry:
+    """
+    Create registry of sites described by arguments from `add_monitor_arguments()`.
+
+    Registry contains only site passed by --url, sites from --sites or
+    --sites-db are loaded from the source returned by `create_sites_source()`.
+    """
+    registry = SiteRegistry()
+    if args.url:
+        registry.add(
+            url=args.url,
+            interval_s=args.interval,
+            match=args.match or '',
+            check_mode=args.check_mode,
+        )
+    return registry
+
+
+def create_sites_source(args: argparse.Namespace) -> typing.Optional[catalog.SitesSource]:
+    """Create source of sites described by arguments from `add_monitor_arguments()`."""
+    if args.sites:
+        return catalog.SitesFile(args.sites, args.interval, args.check_mode)
+    if args.sites_db:
+        return catalog.SitesDbCatalog(
+            db.Dsn(**{**read_json_file(args.db_conn), **read_json_file(args.sites_db)}),
+            args.interval,
+            args.check_mode,
+        )
+    return None
+
+
+def create_throttle(args: argparse.Namespace) -> RequestThrottle:
+    """Create requests throttle described by arguments from `add_monitor_arguments()`."""
+    return RequestThrottle(
+        max_per_host=args.max_per_host,
+        rate_per_s=args.rate_limit,
+        burst=args.rate_burst,
+        max_concurrent=args.max_concurrent_checks,
+    )
+
+
+def get_monitor_options(args: argparse.Namespace) -> MonitorOptions:
+    """Return monitoring options described by arguments from `add_monitor_arguments()`."""
+    return MonitorOptions(
+        change_only=args.change_only,
+        heartbeat_interval_s=args.heartbeat_interval,
+        max_concurrent_checks=args.max_concurrent_checks,
+        throttle=create_throttle(args),
+        profile=profiling.get_profile_options(args),
+        sites_source=create_sites_source(args),
+        reload_interval_s=args.reload_interval,
+    )
+
+
+def _create_http_client(max_concurrent_checks: int) -> httpx.AsyncClient:
+    """
+    Create HTTP client with connection pool large enough for concurrent checks.
+
+    Otherwise requests wait for a free connection after their latency
+    measurement is started, and the wait is reported as latency instead of
+    schedule delay.
+    """
+    return httpx.AsyncClient(limits=httpx.Limits(
+        max_connections=max_concurrent_checks,
+        max_keepalive_connections=max_concurrent_checks,
+    ))
+
+
 def _parse_args(args=None):
     parser = argparse.ArgumentParser()
     kafka.add_kafka_argument(parser)
-    parser.add_argument("--url", type=str, required=True)
-    parser.add_argument("--interval", type=float, default=60)
-    parser.add_argument("--match")
-    return parser.parse_args(args)
+    db.add_db_conn_argument(parser, required=False)
+    add_monitor_arguments(parser)
+    info = parser.parse_args(args)
+    if info.sites_db and not info.db_conn:
+        parser.error("--sites-db requires --db-conn")
+    return info
 
 
 async def monitor_one_site(
@@ -123,9 +750,9 @@ async def monitor_one_site(
     server.register_topic(STATUS_TOPIC_NAME)
     producer = server.get_producer()
     async with producer:
-        async with httpx.AsyncClient() as client:
+        async with _create_http_client(max_concurrent_checks=1) as client:
             while True:
-                start_time = await monitor_and_publish(
+                start_ns = await monitor_and_publish(
                     send_async=producer.send,
                     http_get_async=client.get,
                     url=url,
@@ -133,17 +760,110 @@ async def monitor_one_site(
                 )
                 if is_stop_loop():
                     break
-                await _wait_until_passed(interval, start_time)
+                await _wait_until_passed(interval, start_ns)
+
+
+async def check_sites(
+        send_async: typing.Callable,
+        registry: SiteRegistry,
+        options: typing.Optional[MonitorOptions] = None,
+        is_stop_loop: typing.Callable = lambda: False,
+):
+    """
+    Check all sites from registry and pass results to `send_async`.
+
+    All checks share the same HTTP connection pool. Changes of the sites set
+    are applied without interrupting checks of unchanged sites, state kept
+    for removed sites is dropped and pending heartbeats are published.
+
+    :param send_async: Coroutine publishing site check results to the provided topic.
+    :param registry: monitored sites
+    :param options: monitoring options, defaults are used if not provided
+    :param is_stop_loop: function returning True to stop loop
+
+    """
+    options = options or MonitorOptions()
+    throttle = options.throttle or RequestThrottle(
+        max_per_host=options.max_concurrent_checks,
+        max_concurrent=options.max_concurrent_checks,
+    )
+    publisher = (
+        ChangeOnlyPublisher(send_async, heartbeat_interval_s=options.heartbeat_interval_s)
+        if options.change_only else None
+    )
+    send: typing.Callable = send_async
+    if publisher:
+        send = publisher.send
+    async with profiling.profile_context(options.profile) as lag_monitor, \
+            _create_http_client(options.max_concurrent_checks) as client:
+        context = CheckContext(
+            http_head_async=client.head,
+            throttle=throttle,
+            lag_monitor=lag_monitor,
+            on_forget=publisher.discard if publisher else None,
+        )
+        if options.sites_source:
+            await catalog.reload_sites(registry, options.sites_source)
+        watch_task = (
+            asyncio.create_task(catalog.watch_sites(
+                registry, options.sites_source, options.reload_interval_s,
+                on_removed=context.forget,
+            ))
+            if options.sites_source and options.reload_interval_s > 0 else None
+        )
+        try:
+            await run_checks(
+                registry=registry,
+                send_async=send,
+                http_get_async=client.get,
+                context=context,
+                is_stop_loop=is_stop_loop,
+            )
+        finally:
+            if watch_task:
+                watch_task.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await watch_task
+    if publisher:
+        await publisher.flush()
+
+
+async def monitor_sites(
+        server: kafka.Server,
+        registry: SiteRegistry,
+        options: typing.Optional[MonitorOptions] = None,
+        is_stop_loop: typing.Callable = lambda: False,
+):
+    """
+    Monitor metrics of all sites from registry publishing them to Kafka.
+
+    All checks share the same Kafka producer and HTTP connection pool.
+    Parameters are the same as for `check_sites()` except:
+
+    :param server: Kafka server metadata
+
+    """
+    options = options or MonitorOptions()
+    server.register_topic(STATUS_TOPIC_NAME)
+    if options.change_only:
+        server.register_topic(HEARTBEAT_TOPIC_NAME)
+    producer = server.get_producer()
+    async with producer:
+        await check_sites(
+            send_async=producer.send,
+            registry=registry,
+            options=options,
+            is_stop_loop=is_stop_loop,
+        )
 
 
 def main():
-    """Execute CLI app for single site monitoring."""
+    """Execute CLI app for site monitoring."""
     args = _parse_args()
-    asyncio.run(monitor_one_site(
+    asyncio.run(monitor_sites(
         server=kafka.Server(**read_json_file(args.kafka_conn)),
-        url=args.url,
-        interval=args.interval,
-        match=args.match,
+        registry=create_registry(args),
+        options=get_monitor_options(args),
     ))
 
 
@@ -0,0 +1,214 @@
+"""Event loop lag and slow callbacks profiling."""
+import argparse
+from array import array
+import asyncio
+import collections
+import contextlib
+from dataclasses import dataclass
+import logging
+import sys
+import threading
+import time
+import traceback
+import typing
+
+from sitemon.common import positive_float
+
+
+_log = logging.getLogger(__name__)
+
+# number of the latest loop lag samples kept to find lag during site check
+_LAG_HISTORY_SIZE = 4096
+
+
+@dataclass(frozen=True)
+class ProfileOptions:
+    """Profiling mode parameters."""
+
+    lag_sample_interval_s: float = 0.05
+    """Interval between event loop lag samples, in seconds."""
+
+    slow_callback_s: float = 0.1
+    """Blocking event loop longer than this is reported with stack, in seconds."""
+
+    dump_path: typing.Optional[str] = None
+    """File to write sampling profiler results in collapsed stacks format."""
+
+    dump_interval_s: float = 60
+    """Interval between sampling profiler dumps, in seconds."""
+
+    sampling_interval_s: float = 0.01
+    """Interval between event loop thread stack samples, in seconds."""
+
+
+class LoopLagMonitor:
+    """
+    Measure event loop lag.
+
+    Lag is a delay between the moment when a sleeping task should be woken
+    up and the moment it actually runs. It grows when the loop is blocked
+    by slow callbacks or saturated by ready tasks.
+    """
+
+    def __init__(self, sample_interval_s: float):
+        """
+        Create monitor, lag is sampled only when `run()` is running.
+
+        :param sample_interval_s: interval between loop lag samples, in seconds
+
+        """
+        self._sample_interval_s = sample_interval_s
+        self._samples = array('d', [0.0] * _LAG_HISTORY_SIZE)
+        self._count = 0
+        self.last_tick = time.monotonic()
+        """Monotonic time when the loop was responsive last time."""
+
+    async def run(self):
+        """Sample loop lag until cancelled."""
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self._sample_interval_s)
+            self.last_tick = time.monotonic()
+            lag_s = max(0.0, self.last_tick - start - self._sample_interval_s)
+            self._samples[self._count % _LAG_HISTORY_SIZE] = lag_s
+            self._count += 1
+
+    def get_mark(self) -> int:
+        """Return mark to get lag observed since this moment."""
+        return self._count
+
+    def get_max_lag_s(self, mark: int) -> float:
+        """Return maximal loop lag observed since `mark`, in seconds."""
+        count = min(self._count - mark, _LAG_HISTORY_SIZE)
+        return max(
+            (self._samples[(self._count - i - 1) % _LAG_HISTORY_SIZE] for i in range(count)),
+            default=0.0,
+        )
+
+
+def _format_frame(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+
+
+def _collapse_stack(frame) -> str:
+    names = []
+    while frame is not None:
+        names.append(_format_frame(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class _Watchdog(threading.Thread):
+    """Thread reporting event loop stalls and sampling its stack."""
+
+    def __init__(self, options: ProfileOptions, lag_monitor: LoopLagMonitor):
+        super().__init__(name='sitemon-profiler', daemon=True)
+        self._options = options
+        self._lag_monitor = lag_monitor
+        self._loop_thread_id = threading.get_ident()
+        self._stop_event = threading.Event()
+        self._samples: typing.Counter[str] = collections.Counter()
+
+    def stop(self):
+        """Stop thread and write the final profiler dump."""
+        self._stop_event.set()
+        self.join()
+        self._dump()
+
+    def run(self):
+        options = self._options
+        stall_threshold_s = options.slow_callback_s + options.lag_sample_interval_s
+        poll_interval_s = min(options.sampling_interval_s, options.slow_callback_s / 2)
+        reported_tick = None
+        next_dump = time.monotonic() + options.dump_interval_s
+        while not self._stop_event.wait(poll_interval_s):
+            frames = sys._current_frames()  # pylint: disable=protected-access
+            frame = frames.get(self._loop_thread_id)
+            if frame is None:
+                continue
+            now = time.monotonic()
+            last_tick = self._lag_monitor.last_tick
+            if now - last_tick > stall_threshold_s and reported_tick != last_tick:
+                reported_tick = last_tick
+                _log.warning(
+                    "Event loop is blocked for %.3f s by:\n%s",
+                    now - last_tick,
+                    ''.join(traceback.format_stack(frame)),
+                )
+            if options.dump_path:
+                self._samples[_collapse_stack(frame)] += 1
+                if now >= next_dump:
+                    next_dump = now + options.dump_interval_s
+                    self._dump()
+
+    def _dump(self):
+        if not self._options.dump_path:
+            return
+        with open(self._options.dump_path, 'w') as f:
+            for stack, count in self._samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+@contextlib.asynccontextmanager
+async def profile_context(
+        options: typing.Optional[ProfileOptions],
+) -> typing.AsyncIterator[typing.Optional[LoopLagMonitor]]:
+    """
+    Profile the running event loop if `options` are provided.
+
+    :returns: loop lag monitor or None if profiling is off
+
+    """
+    if options is None:
+        yield None
+        return
+
+    lag_monitor = LoopLagMonitor(options.lag_sample_interval_s)
+    lag_task = asyncio.create_task(lag_monitor.run())
+    watchdog = _Watchdog(options, lag_monitor)
+    watchdog.start()
+    try:
+        yield lag_monitor
+    finally:
+        watchdog.stop()
+        lag_task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await lag_task
+
+
+def add_profile_arguments(parser: argparse.ArgumentParser):
+    """Add profiling mode parameters to ArgumentParser."""
+    defaults = ProfileOptions()
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="sample event loop lag and report slow callbacks with their stacks",
+    )
+    parser.add_argument(
+        "--slow-callback-ms",
+        type=positive_float,
+        default=defaults.slow_callback_s * 1000,
+        help="report callbacks blocking event loop longer than this, in milliseconds",
+    )
+    parser.add_argument(
+        "--profile-dump",
+        help="file to periodically write sampling profiler results in collapsed stacks format",
+    )
+    parser.add_argument(
+        "--profile-dump-interval",
+        type=positive_float,
+        default=defaults.dump_interval_s,
+        help="interval between sampling profiler dumps, in seconds",
+    )
+
+
+def get_profile_options(args: argparse.Namespace) -> typing.Optional[ProfileOptions]:
+    """Return profiling options if profiling is requested by arguments."""
+    if not args.profile:
+        return None
+    return ProfileOptions(
+        slow_callback_s=args.slow_callback_ms / 1000,
+        dump_path=args.profile_dump,
+        dump_interval_s=args.profile_dump_interval,
+    )
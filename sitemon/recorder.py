@@ -1,40 +1,163 @@
 """Functionality to record sitew status events to the database."""
 import argparse
 import asyncio
+import contextlib
 import sys
 import typing
 
 from sitemon.common import (
+    HEARTBEAT_TOPIC_NAME,
+    parse_site_heartbeat,
+    parse_site_status,
     read_json_file,
-    SiteStatus,
     STATUS_TOPIC_NAME,
 )
 from sitemon import (
     db,
     kafka,
+    profiling,
 )
 
 
+#: Default maximal number of messages in the in-process queue.
+DEFAULT_QUEUE_SIZE = 10000
+
+#: Default maximal number of messages stored to the database at once.
+DEFAULT_BATCH_SIZE = 500
+
+
+async def store_messages(
+        site_state_db: db.SiteState,
+        messages: typing.Iterable[typing.Tuple[str, dict]],
+):
+    """
+    Store batch of (topic, message data) pairs to the database.
+
+    Site statuses are stored as separate checks, heartbeats produced by
+    monitors in change-only mode are stored as intervals.
+    """
+    statuses = []
+    heartbeats = []
+    for topic, data in messages:
+        if topic == HEARTBEAT_TOPIC_NAME:
+            heartbeats.append(parse_site_heartbeat(data))
+        else:
+            statuses.append(parse_site_status(data))
+    if len(statuses) == 1:
+        await site_state_db.insert_site_status(statuses[0])
+    elif statuses:
+        await site_state_db.insert_site_statuses(statuses)
+    if len(heartbeats) == 1:
+        await site_state_db.insert_site_heartbeat(heartbeats[0])
+    elif heartbeats:
+        await site_state_db.insert_site_heartbeats(heartbeats)
+
+
+class QueueRecorder:
+    """
+    Store messages passed through bounded in-process queue to the database.
+
+    `send()` is compatible with `send_async` of `sitemon.monitor`, it waits
+    if queue is full, so checks are slowed down when database can't keep up.
+    """
+
+    def __init__(
+            self,
+            max_queue_size: int = DEFAULT_QUEUE_SIZE,
+            max_batch_size: int = DEFAULT_BATCH_SIZE,
+    ):
+        """
+        Create recorder, it should be created while the event loop is running.
+
+        :param max_queue_size: maximal number of messages waiting to be stored
+        :param max_batch_size: maximal number of messages stored at once
+
+        """
+        self._queue: asyncio.Queue = asyncio.Queue(max_queue_size)
+        self._max_batch_size = max_batch_size
+
+    async def send(self, topic: str, data: dict):
+        """Put message to the queue."""
+        await self._queue.put((topic, data))
+
+    async def join(self):
+        """Wait until all queued messages are stored."""
+        await self._queue.join()
+
+    async def run(self, site_state_db: db.SiteState):
+        """Store queued messages in batches until cancelled or failed."""
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self._max_batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                await store_messages(site_state_db, batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def run_until_complete(
+            self,
+            site_state_db: db.SiteState,
+            sender: typing.Awaitable,
+    ) -> typing.Any:
+        """
+        Store messages while `sender` is running and until all of them are stored.
+
+        If storing fails, `sender` is cancelled and the error is raised, so
+        senders never wait forever for the space in the queue.
+
+        :param site_state_db: destination database
+        :param sender: awaitable passing messages to `send()`
+        :returns: result of `sender`
+
+        """
+        async def send_all():
+            result = await sender
+            await self.join()
+            return result
+
+        record_task = asyncio.create_task(self.run(site_state_db))
+        send_task = asyncio.create_task(send_all())
+        try:
+            await asyncio.wait({record_task, send_task}, return_when=asyncio.FIRST_COMPLETED)
+            if record_task.done():
+                send_task.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await send_task
+                return record_task.result()
+            return send_task.result()
+        finally:
+            for task in (send_task, record_task):
+                task.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await task
+
+
 async def collect_data(
         server: kafka.Server,
         dsn: db.Dsn,
-        is_stop_loop: typing.Callable = lambda: False
+        is_stop_loop: typing.Callable = lambda: False,
+        profile: typing.Optional[profiling.ProfileOptions] = None,
 ):
     """
     Collect events from Kafka and store them to the database.
 
+    Events are stored by `store_messages()`.
+
     :param is_stop_loop: function returning True to stop loop
+    :param profile: profiling mode options or None if profiling is off
 
     """
-    consumer = server.get_consumer(STATUS_TOPIC_NAME)
-    async with consumer:
+    server.register_topic(HEARTBEAT_TOPIC_NAME)
+    consumer = server.get_consumer(STATUS_TOPIC_NAME, HEARTBEAT_TOPIC_NAME)
+    async with profiling.profile_context(profile), consumer:
         async with db.connection_context(dsn) as db_connection:
             site_state_db = db.SiteState(db_connection)
             await site_state_db.try_init()
             while True:
                 msg = await consumer.getone()
-                status = SiteStatus(**msg.value)
-                await site_state_db.insert_site_status(status)
+                await store_messages(site_state_db, [(msg.topic, msg.value)])
                 if is_stop_loop():
                     break
 
@@ -50,6 +173,7 @@ def _parse_args(args=None):
             + db.USER_DB_JSON_EXAMPLE
         ),
     )
+    profiling.add_profile_arguments(parser)
     return parser.parse_args(args)
 
 
@@ -59,6 +183,7 @@ def main():
     asyncio.run(collect_data(
         server=kafka.Server(**read_json_file(args.kafka_conn)),
         dsn=db.Dsn(**read_json_file(args.db_conn), **read_json_file(args.db)),
+        profile=profiling.get_profile_options(args),
     ))
     sys.exit(0)
 
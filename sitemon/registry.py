@@ -0,0 +1,253 @@
+"""Compact storage of monitored sites metadata and state."""
+from array import array
+import heapq
+import typing
+
+from sitemon.common import CheckMode
+
+
+# due time and site index are packed into a single int heap key
+_INDEX_BITS = 24
+_INDEX_MASK = (1 << _INDEX_BITS) - 1
+
+#: Maximal number of sites registry can hold.
+MAX_SITES = 1 << _INDEX_BITS
+
+#: Due time of the site which is not scheduled (removed or being checked).
+NOT_SCHEDULED = -1
+
+_CHECK_MODES = tuple(CheckMode)
+
+
+class StringPool:
+    """
+    Intern strings referring them by integer ids.
+
+    Strings are reference counted: each `add()` should be paired with
+    `release()`, string is removed when it is released as many times as it
+    was added, its id is reused later.
+    """
+
+    def __init__(self):
+        """Create empty pool."""
+        self._ids: typing.Dict[str, int] = {}
+        self._strings: typing.List[typing.Optional[str]] = []
+        self._refs = array('L')
+        self._free: typing.List[int] = []
+
+    def add(self, value: str) -> int:
+        """Return id of the string, adding it to the pool if needed."""
+        string_id = self._ids.get(value)
+        if string_id is not None:
+            self._refs[string_id] += 1
+            return string_id
+        if self._free:
+            string_id = self._free.pop()
+            self._strings[string_id] = value
+            self._refs[string_id] = 1
+        else:
+            string_id = len(self._strings)
+            self._strings.append(value)
+            self._refs.append(1)
+        self._ids[value] = string_id
+        return string_id
+
+    def release(self, string_id: int):
+        """Release reference to the string, removing it if it is not used anymore."""
+        self._refs[string_id] -= 1
+        if not self._refs[string_id]:
+            del self._ids[self[string_id]]
+            self._strings[string_id] = None
+            self._free.append(string_id)
+
+    def __getitem__(self, string_id: int) -> str:
+        value = self._strings[string_id]
+        assert value is not None
+        return value
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+
+class SiteRegistry:  # pylint: disable=too-many-instance-attributes
+    """
+    Registry of monitored sites stored as struct of arrays.
+
+    Each site is referred by an integer index. All per-site data is kept in
+    typed `array.array` columns, URLs and match expressions are interned in
+    `StringPool`. Indices of removed sites are reused by newly added ones,
+    generation of the index is changed on removal to detect reuse. Strings
+    are released on removal, so memory used by the registry is bounded by
+    the maximal number of simultaneously registered sites.
+
+    Due times are integer milliseconds of the monotonic clock.
+    """
+
+    def __init__(self):
+        """Create empty registry."""
+        self._strings = StringPool()
+        self._url_ids = array('L')
+        self._match_ids = array('L')
+        self._intervals_s = array('d')
+        self._next_due_ms = array('q')
+        self._http_codes = array('H')
+        self._latencies_s = array('f')
+        self._is_match_found = array('b')
+        self._check_modes = array('b')
+        self._generations = array('L')
+        self._is_free = array('b')
+        self._free: typing.List[int] = []
+        self._due: typing.List[int] = []
+
+    def __len__(self) -> int:
+        return len(self._url_ids) - len(self._free)
+
+    def add(  # pylint: disable=too-many-arguments
+            self,
+            url: str,
+            interval_s: float,
+            match: str = '',
+            due_ms: int = 0,
+            check_mode: CheckMode = CheckMode.Get,
+    ) -> int:
+        """
+        Register site to monitor.
+
+        :param url: full URL of the monitored site
+        :param interval_s: interval between site checks, in seconds
+        :param match: regexp to search in the response or '' if no search needed
+        :param due_ms: moment of the first check or `NOT_SCHEDULED` to
+            schedule it later by `schedule()`
+        :param check_mode: how to request the site
+        :returns: index of the site
+
+        """
+        url_id = self._strings.add(url)
+        match_id = self._strings.add(match)
+        check_mode_id = _CHECK_MODES.index(check_mode)
+        if self._free:
+            index = self._free.pop()
+            self._url_ids[index] = url_id
+            self._match_ids[index] = match_id
+            self._intervals_s[index] = interval_s
+            self._http_codes[index] = 0
+            self._latencies_s[index] = 0
+            self._is_match_found[index] = 0
+            self._check_modes[index] = check_mode_id
+            self._is_free[index] = 0
+        else:
+            index = len(self._url_ids)
+            if index >= MAX_SITES:
+                raise OverflowError(f"Registry can't hold more than {MAX_SITES} sites")
+            self._url_ids.append(url_id)
+            self._match_ids.append(match_id)
+            self._intervals_s.append(interval_s)
+            self._next_due_ms.append(NOT_SCHEDULED)
+            self._http_codes.append(0)
+            self._latencies_s.append(0)
+            self._is_match_found.append(0)
+            self._check_modes.append(check_mode_id)
+            self._generations.append(0)
+            self._is_free.append(0)
+        if due_ms != NOT_SCHEDULED:
+            self.schedule(index, due_ms)
+        return index
+
+    def update(self, index: int, interval_s: float, check_mode: CheckMode):
+        """Change site check parameters, keeping its schedule and status."""
+        self._intervals_s[index] = interval_s
+        self._check_modes[index] = _CHECK_MODES.index(check_mode)
+
+    def remove(self, index: int):
+        """Unregister site, its index can be reused later. Removing it again does nothing."""
+        if self._is_free[index]:
+            return
+        self._is_free[index] = 1
+        self._strings.release(self._url_ids[index])
+        self._strings.release(self._match_ids[index])
+        self._next_due_ms[index] = NOT_SCHEDULED
+        self._generations[index] = (self._generations[index] + 1) & 0xffffffff
+        self._free.append(index)
+
+    def iter_indices(self) -> typing.Iterator[int]:
+        """Iterate over indices of registered sites."""
+        return (index for index, is_free in enumerate(self._is_free) if not is_free)
+
+    def get_generation(self, index: int) -> int:
+        """Return value changed each time site with this index is removed."""
+        return self._generations[index]
+
+    def get_url(self, index: int) -> str:
+        """Return URL of the site."""
+        return self._strings[self._url_ids[index]]
+
+    def get_match(self, index: int) -> str:
+        """Return expression to search in the site response."""
+        return self._strings[self._match_ids[index]]
+
+    def get_interval_s(self, index: int) -> float:
+        """Return interval between site checks, in seconds."""
+        return self._intervals_s[index]
+
+    def get_check_mode(self, index: int) -> CheckMode:
+        """Return how the site should be requested."""
+        return _CHECK_MODES[self._check_modes[index]]
+
+    def set_status(self, index: int, http_code: int, latency_s: float, is_match_found: bool):
+        """Store the last site status."""
+        self._http_codes[index] = http_code
+        self._latencies_s[index] = latency_s
+        self._is_match_found[index] = is_match_found
+
+    def get_status(self, index: int) -> typing.Tuple[int, float, bool]:
+        """
+        Return the last site status.
+
+        :returns: (http_code, latency_s, is_match_found), http_code is 0 if
+            site was not checked yet
+
+        """
+        return (
+            self._http_codes[index],
+            self._latencies_s[index],
+            bool(self._is_match_found[index]),
+        )
+
+    def get_due_ms(self, index: int) -> int:
+        """Return due time of the next site check or `NOT_SCHEDULED`."""
+        return self._next_due_ms[index]
+
+    def schedule(self, index: int, due_ms: int):
+        """Schedule the next site check."""
+        due_ms = max(due_ms, 0)
+        self._next_due_ms[index] = due_ms
+        heapq.heappush(self._due, (due_ms << _INDEX_BITS) | index)
+
+    def pop_due(self, now_ms: int) -> typing.List[int]:
+        """
+        Return indices of sites with checks due and mark them as not scheduled.
+
+        Sites should be re-scheduled by `schedule()` after the check.
+        """
+        return [index for index, _ in self.pop_due_with_time(now_ms)]
+
+    def pop_due_with_time(self, now_ms: int) -> typing.List[typing.Tuple[int, int]]:
+        """Pop due sites like `pop_due()` does, return (index, due_ms) pairs."""
+        due = []
+        while self._due and (self._due[0] >> _INDEX_BITS) <= now_ms:
+            key = heapq.heappop(self._due)
+            index = key & _INDEX_MASK
+            due_ms = key >> _INDEX_BITS
+            if self._next_due_ms[index] == due_ms:
+                self._next_due_ms[index] = NOT_SCHEDULED
+                due.append((index, due_ms))
+        return due
+
+    def get_next_due_ms(self) -> typing.Optional[int]:
+        """Return the nearest due time or None if nothing is scheduled."""
+        while self._due:
+            key = self._due[0]
+            if self._next_due_ms[key & _INDEX_MASK] == key >> _INDEX_BITS:
+                return key >> _INDEX_BITS
+            heapq.heappop(self._due)
+        return None
@@ -0,0 +1,503 @@
+"""Load generator driving the recorder with synthetic or captured site statuses."""
+import argparse
+import asyncio
+import contextlib
+from dataclasses import dataclass
+import functools
+import itertools
+import json
+import math
+import random
+import sys
+import time
+import typing
+import uuid
+
+from sitemon.common import (
+    positive_float,
+    positive_int,
+    read_json_file,
+    SiteStatus,
+    STATUS_TOPIC_NAME,
+)
+from sitemon import (
+    db,
+    kafka,
+    recorder,
+)
+
+
+#: Minimal ratio of recorded to target rows rate to treat rate as sustained.
+MIN_SUSTAINED_RATIO = 0.95
+
+#: Default maximal 99th percentile of lag to treat rate as sustained, in seconds.
+DEFAULT_MAX_LAG_S = 1.0
+
+# interval between checks whether all sent statuses are recorded
+_DRAIN_POLL_INTERVAL_S = 0.5
+
+# number of requests to the database server to measure clock offset
+_CLOCK_SAMPLES = 5
+
+
+def generate_statuses(  # pylint: disable=too-many-arguments
+        url_prefix: str,
+        site_count: int,
+        error_rate: float = 0.0,
+        latency_median_s: float = 0.2,
+        latency_sigma: float = 0.5,
+        seed: typing.Optional[int] = None,
+) -> typing.Iterator[dict]:
+    """
+    Generate synthetic site status messages cycling over `site_count` sites.
+
+    Latency has log-normal distribution, errors are reported as HTTP 500.
+    `check_time_ns` is set when message is sent.
+    """
+    rnd = random.Random(seed)
+    mu = math.log(latency_median_s)
+    for index in itertools.cycle(range(site_count)):
+        is_error = rnd.random() < error_rate
+        yield SiteStatus(
+            url=f"{url_prefix}{index}",
+            check_time_ns=0,
+            http_code=500 if is_error else 200,
+            latency_s=rnd.lognormvariate(mu, latency_sigma),
+            match='',
+            is_match_found=not is_error,
+        )._asdict()
+
+
+def read_capture(path: str, url_prefix: str) -> typing.Iterator[dict]:
+    """
+    Replay site status messages from NDJSON file in a loop.
+
+    Site URLs are prefixed by `url_prefix` to distinguish replayed statuses,
+    `check_time_ns` is set when message is sent.
+    """
+    while True:
+        count = 0
+        with open(path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                data = json.loads(line)
+                data.pop('check_time_iso', None)
+                data['url'] = url_prefix + data['url']
+                count += 1
+                yield data
+        if not count:
+            raise ValueError(f"No statuses in {path}")
+
+
+async def publish_at_rate(
+        send_async: typing.Callable,
+        messages: typing.Iterator[dict],
+        rate: float,
+        duration_s: float,
+        clock_offset_ns: int = 0,
+) -> int:
+    """
+    Publish `rate` messages per second during `duration_s`.
+
+    If sending is slower than the target rate, messages are sent without
+    pauses until the schedule is caught up.
+
+    :param clock_offset_ns: added to the local time to get `check_time_ns`
+    :returns: number of sent messages
+
+    """
+    total = int(rate * duration_s)
+    start = time.monotonic()
+    sent = 0
+    while sent < total:
+        delay_s = start + sent / rate - time.monotonic()
+        if delay_s > 0:
+            await asyncio.sleep(delay_s)
+        due_count = min(total, int((time.monotonic() - start) * rate) + 1)
+        while sent < due_count:
+            data = next(messages)
+            data['check_time_ns'] = time.time_ns() + clock_offset_ns
+            await send_async(STATUS_TOPIC_NAME, data)
+            sent += 1
+    return sent
+
+
+@dataclass(frozen=True)
+class StepResult:  # pylint: disable=too-many-instance-attributes
+    """Results of publishing statuses at the target rate."""
+
+    target_rate: float
+    """Target rate, statuses per second."""
+
+    sent: int
+    """Number of sent statuses."""
+
+    publish_rate: float
+    """Achieved publishing rate, statuses per second."""
+
+    rows: int
+    """Number of recorded rows."""
+
+    rows_rate: float
+    """Sustained recording rate, rows per second."""
+
+    lag_p50_s: float
+    """Median time between check and recording, in seconds."""
+
+    lag_p90_s: float
+    """90th percentile of the time between check and recording, in seconds."""
+
+    lag_p99_s: float
+    """99th percentile of the time between check and recording, in seconds."""
+
+    lag_max_s: float
+    """Maximal time between check and recording, in seconds."""
+
+    def is_sustained(self, max_lag_s: float = DEFAULT_MAX_LAG_S) -> bool:
+        """Check all statuses were recorded at the target rate without growing lag."""
+        return (
+            self.rows >= self.sent
+            and self.rows_rate >= self.target_rate * MIN_SUSTAINED_RATIO
+            and self.lag_p99_s <= max_lag_s
+        )
+
+    def __str__(self):
+        return (
+            f"target {self.target_rate:.0f}/s: sent {self.sent} at {self.publish_rate:.1f}/s,"
+            f" recorded {self.rows} at {self.rows_rate:.1f} rows/s,"
+            f" lag p50 {self.lag_p50_s:.3f} s, p90 {self.lag_p90_s:.3f} s,"
+            f" p99 {self.lag_p99_s:.3f} s, max {self.lag_max_s:.3f} s"
+        )
+
+
+async def measure_clock_offset(stats_db: db.SiteState) -> typing.Tuple[int, int]:
+    """
+    Measure offset of the database server clock from the local one.
+
+    Offset is taken from the request with the shortest round trip, assuming
+    server time is read in the middle of it.
+
+    :returns: (offset, error) in nanoseconds, server time is local time plus
+        offset, error is the half of the round trip time
+
+    """
+    samples = []
+    for _ in range(_CLOCK_SAMPLES):
+        before_ns = time.time_ns()
+        server_ns = await stats_db.get_time_ns()
+        after_ns = time.time_ns()
+        samples.append((after_ns - before_ns, server_ns - (before_ns + after_ns) // 2))
+    round_trip_ns, offset_ns = min(samples)
+    return offset_ns, round_trip_ns // 2
+
+
+def get_url_pattern(url_prefix: str) -> str:
+    """Return SQL LIKE pattern matching URLs with the prefix."""
+    return url_prefix.replace('%', r'\%').replace('_', r'\_') + '%'
+
+
+async def _wait_recorded(
+        stats_db: db.SiteState,
+        stats_args: tuple,
+        sent: int,
+        timeout_s: float,
+):
+    deadline = time.monotonic() + timeout_s
+    while True:
+        stats = await stats_db.get_record_stats(*stats_args)
+        if stats['rows'] >= sent or time.monotonic() >= deadline:
+            return stats
+        await asyncio.sleep(_DRAIN_POLL_INTERVAL_S)
+
+
+@dataclass(frozen=True)
+class ReplayOptions:
+    """Parameters of publishing steps."""
+
+    url_prefix: str
+    """Prefix of all published status URLs."""
+
+    rates: typing.Sequence[float] = (100.0,)
+    """Target rates, statuses per second."""
+
+    step_duration_s: float = 30.0
+    """Publishing duration for each rate, in seconds."""
+
+    drain_timeout_s: float = 30.0
+    """Maximal time to wait for recording after publishing, in seconds."""
+
+    clock_offset_ns: int = 0
+    """Offset of the database server clock from the local one.
+
+    Check time is reported by the server clock, so lag and recording rate
+    are measured by the single clock.
+    """
+
+
+def _make_step_result(
+        rate: float,
+        sent: int,
+        publish_s: float,
+        stats: typing.Mapping,
+        begin_ns: int,
+) -> StepResult:
+    rows = stats['rows']
+    record_s = (stats['last_record_s'] or begin_ns / 1e9) - begin_ns / 1e9
+    lag_s = stats['lag_s'] or [math.nan] * 3
+    return StepResult(
+        target_rate=rate,
+        sent=sent,
+        publish_rate=sent / publish_s,
+        rows=rows,
+        rows_rate=rows / record_s if record_s > 0 else 0.0,
+        lag_p50_s=lag_s[0],
+        lag_p90_s=lag_s[1],
+        lag_p99_s=lag_s[2],
+        lag_max_s=stats['max_lag_s'] if stats['max_lag_s'] is not None else math.nan,
+    )
+
+
+async def run_steps(
+        send_async: typing.Callable,
+        flush_async: typing.Callable,
+        stats_db: db.SiteState,
+        messages: typing.Iterator[dict],
+        options: ReplayOptions,
+) -> typing.List[StepResult]:
+    """
+    Publish statuses at each of target rates and measure recording.
+
+    :param send_async: Coroutine publishing message to the provided topic.
+    :param flush_async: Coroutine waiting until published messages are sent.
+    :param stats_db: database connection used to get recording statistics
+    :param messages: status messages to publish
+    :param options: target rates and durations of the steps
+
+    """
+    url_pattern = get_url_pattern(options.url_prefix)
+    results = []
+    for rate in options.rates:
+        # Rows of the step are recorded after it starts, so the ID filter
+        # limits polling to the step rows instead of the whole table
+        after_id = await stats_db.get_last_state_id()
+        begin_ns = time.time_ns() + options.clock_offset_ns
+        start = time.monotonic()
+        sent = await publish_at_rate(
+            send_async, messages, rate, options.step_duration_s, options.clock_offset_ns,
+        )
+        await flush_async()
+        publish_s = time.monotonic() - start
+        end_ns = time.time_ns() + options.clock_offset_ns
+        stats = await _wait_recorded(
+            stats_db, (url_pattern, after_id, begin_ns, end_ns), sent, options.drain_timeout_s,
+        )
+        results.append(_make_step_result(rate, sent, publish_s, stats, begin_ns))
+        print(results[-1], flush=True)
+    return results
+
+
+def find_saturation_rate(
+        results: typing.Iterable[StepResult],
+        max_lag_s: float = DEFAULT_MAX_LAG_S,
+) -> typing.Optional[float]:
+    """Return the lowest target rate which was not sustained or None."""
+    return next(
+        (result.target_rate for result in results if not result.is_sustained(max_lag_s)),
+        None,
+    )
+
+
+async def replay(
+        info: argparse.Namespace,
+        dsn: db.Dsn,
+        server: typing.Optional[kafka.Server] = None,
+) -> typing.List[StepResult]:
+    """
+    Drive the recorder by status messages as described by CLI arguments.
+
+    Messages are published to Kafka if `server` is provided, otherwise they
+    are stored by in-process `sitemon.recorder.QueueRecorder`. Replayed sites
+    and their states are deleted at exit unless `info.keep` is set.
+    """
+    url_prefix = f"https://replay-{uuid.uuid4().hex[:8]}.invalid/"
+    messages = (
+        read_capture(info.capture, url_prefix) if info.capture
+        else generate_statuses(
+            url_prefix + 'site/',
+            site_count=info.sites,
+            error_rate=info.error_rate,
+            latency_median_s=info.latency_median,
+            latency_sigma=info.latency_sigma,
+            seed=info.seed,
+        )
+    )
+    async with contextlib.AsyncExitStack() as stack:
+        stats_connection = await stack.enter_async_context(db.connection_context(dsn))
+        stats_db = db.SiteState(stats_connection)
+        await stats_db.try_init()
+        if not info.keep:
+            stack.push_async_callback(stats_db.delete_sites, get_url_pattern(url_prefix))
+        clock_offset_ns, clock_error_ns = await measure_clock_offset(stats_db)
+        print(f"Replayed sites URL prefix: {url_prefix}", flush=True)
+        print(
+            f"DB server clock offset: {clock_offset_ns / 1e6:.3f}"
+            f" ± {clock_error_ns / 1e6:.3f} ms, check time is set by the server clock",
+            flush=True,
+        )
+        run_replay_steps = functools.partial(
+            run_steps,
+            stats_db=stats_db,
+            messages=messages,
+            options=ReplayOptions(
+                url_prefix=url_prefix,
+                rates=info.rates,
+                step_duration_s=info.duration,
+                drain_timeout_s=info.drain_timeout,
+                clock_offset_ns=clock_offset_ns,
+            ),
+        )
+        if server:
+            server.register_topic(STATUS_TOPIC_NAME)
+            producer = await stack.enter_async_context(server.get_producer())
+            results = await run_replay_steps(
+                send_async=producer.send,
+                flush_async=producer.flush,
+            )
+        else:
+            queue_recorder = recorder.QueueRecorder(info.queue_size, info.batch_size)
+            record_connection = await stack.enter_async_context(db.connection_context(dsn))
+            results = await queue_recorder.run_until_complete(
+                db.SiteState(record_connection),
+                run_replay_steps(
+                    send_async=queue_recorder.send,
+                    flush_async=_no_flush,
+                ),
+            )
+    return results
+
+
+async def _no_flush():
+    pass
+
+
+def _parse_rates(value: str) -> typing.List[float]:
+    rates = [float(rate) for rate in value.split(',')]
+    if not all(rate > 0 for rate in rates):
+        raise argparse.ArgumentTypeError("rates should be positive")
+    return rates
+
+
+def _parse_args(args=None):
+    parser = argparse.ArgumentParser()
+    db.add_db_conn_argument(parser)
+    parser.add_argument(
+        "--kafka-conn",
+        help=(
+            "JSON file describing Kafka connection, statuses are published to Kafka"
+            " and should be stored by sitemon-recorder; if not provided, statuses are"
+            " stored by in-process recorder"
+        ),
+    )
+    parser.add_argument(
+        "--rates",
+        type=_parse_rates,
+        default=[100.0],
+        help="comma-separated list of target rates to try in turn, statuses per second",
+    )
+    parser.add_argument(
+        "--duration",
+        type=positive_float,
+        default=30,
+        help="publishing duration for each rate, in seconds",
+    )
+    parser.add_argument(
+        "--drain-timeout",
+        type=float,
+        default=30,
+        help="maximal time to wait for recording after publishing, in seconds",
+    )
+    parser.add_argument(
+        "--max-lag",
+        type=float,
+        default=DEFAULT_MAX_LAG_S,
+        help="maximal 99th percentile of lag to treat rate as sustained, in seconds",
+    )
+    parser.add_argument(
+        "--capture",
+        help="NDJSON file with site status messages to replay instead of synthetic ones",
+    )
+    parser.add_argument(
+        "--sites",
+        type=positive_int,
+        default=1000,
+        help="number of synthetic sites",
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.01,
+        help="share of synthetic statuses with errors",
+    )
+    parser.add_argument(
+        "--latency-median",
+        type=positive_float,
+        default=0.2,
+        help="median of synthetic log-normal latency, in seconds",
+    )
+    parser.add_argument(
+        "--latency-sigma",
+        type=float,
+        default=0.5,
+        help="sigma of synthetic log-normal latency",
+    )
+    parser.add_argument("--seed", type=int, help="random seed for synthetic statuses")
+    parser.add_argument(
+        "--keep",
+        action="store_true",
+        help="keep replayed sites and statuses in the database, they are deleted by default",
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=positive_int,
+        default=recorder.DEFAULT_QUEUE_SIZE,
+        help="in-process recorder queue size",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=positive_int,
+        default=recorder.DEFAULT_BATCH_SIZE,
+        help="in-process recorder batch size",
+    )
+    parser.add_argument(
+        "db",
+        help=(
+            "JSON file with destination DB description in the format:\n\n"
+            + db.USER_DB_JSON_EXAMPLE
+        ),
+    )
+    return parser.parse_args(args)
+
+
+def main():
+    """Execute CLI app measuring recorder capacity."""
+    info = _parse_args()
+    results = asyncio.run(replay(
+        info,
+        dsn=db.Dsn(**{**read_json_file(info.db_conn), **read_json_file(info.db)}),
+        server=kafka.Server(**read_json_file(info.kafka_conn)) if info.kafka_conn else None,
+    ))
+    saturation_rate = find_saturation_rate(results, info.max_lag)
+    sustained = [result for result in results if result.is_sustained(info.max_lag)]
+    if sustained:
+        best = max(sustained, key=lambda result: result.rows_rate)
+        print(f"Sustained: {best.rows_rate:.1f} rows/s at target {best.target_rate:.0f}/s")
+    if saturation_rate is None:
+        print("Saturation point is not reached")
+    else:
+        print(f"Saturation point: target {saturation_rate:.0f}/s")
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
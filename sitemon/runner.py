@@ -0,0 +1,92 @@
+"""Site monitor and recorder running in the same process without Kafka."""
+import argparse
+import asyncio
+import sys
+import typing
+
+from sitemon.common import positive_int, read_json_file
+from sitemon import (
+    db,
+    monitor,
+    recorder,
+)
+from sitemon.registry import SiteRegistry
+
+
+async def run_pipeline(
+        dsn: db.Dsn,
+        registry: SiteRegistry,
+        options: typing.Optional[monitor.MonitorOptions] = None,
+        queue_recorder: typing.Optional[recorder.QueueRecorder] = None,
+        is_stop_loop: typing.Callable = lambda: False,
+):
+    """
+    Monitor all sites from registry and store results to the database.
+
+    Check results are passed to the database writer through bounded
+    in-process queue, checks are stopped if storing fails. Parameters are
+    the same as for `sitemon.monitor.check_sites()` except:
+
+    :param dsn: destination database
+    :param queue_recorder: queue passing check results to the database,
+        created with default sizes if not provided; it should be created
+        while the event loop is running
+
+    """
+    queue_recorder = queue_recorder or recorder.QueueRecorder()
+    async with db.connection_context(dsn) as db_connection:
+        site_state_db = db.SiteState(db_connection)
+        await site_state_db.try_init()
+        await queue_recorder.run_until_complete(site_state_db, monitor.check_sites(
+            send_async=queue_recorder.send,
+            registry=registry,
+            options=options,
+            is_stop_loop=is_stop_loop,
+        ))
+
+
+def _parse_args(args=None):
+    parser = argparse.ArgumentParser()
+    db.add_db_conn_argument(parser)
+    monitor.add_monitor_arguments(parser)
+    parser.add_argument(
+        "--queue-size",
+        type=positive_int,
+        default=recorder.DEFAULT_QUEUE_SIZE,
+        help="maximal number of check results waiting to be stored",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=positive_int,
+        default=recorder.DEFAULT_BATCH_SIZE,
+        help="maximal number of check results stored at once",
+    )
+    parser.add_argument(
+        "db",
+        help=(
+            "JSON file with destination DB description in the format:\n\n"
+            + db.USER_DB_JSON_EXAMPLE
+        ),
+    )
+    return parser.parse_args(args)
+
+
+def main():
+    """Execute CLI app monitoring sites and recording results without Kafka."""
+    args = _parse_args()
+
+    async def run():
+        # queue should be created by the running event loop
+        await run_pipeline(
+            dsn=db.Dsn(**{**read_json_file(args.db_conn), **read_json_file(args.db)}),
+            registry=monitor.create_registry(args),
+            options=monitor.get_monitor_options(args),
+            queue_recorder=recorder.QueueRecorder(args.queue_size, args.batch_size),
+        )
+
+    asyncio.run(run())
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""Limits of the HTTP(S) requests rate and concurrency."""
+import asyncio
+import collections
+import contextlib
+import time
+import typing
+
+
+#: Default maximal number of simultaneous requests to the same host.
+DEFAULT_MAX_PER_HOST = 2
+
+
+class _HostState:  # pylint: disable=too-few-public-methods
+    """Requests to the same host: running ones and waiting for the slot."""
+
+    __slots__ = ('active', 'waiters', 'is_ready')
+
+    def __init__(self):
+        self.active = 0
+        self.waiters: typing.Deque[asyncio.Future] = collections.deque()
+        self.is_ready = False
+
+
+class RequestThrottle:  # pylint: disable=too-many-instance-attributes,too-few-public-methods
+    """
+    Limit requests concurrency per host, global concurrency and requests rate.
+
+    Requests waiting for the slot are queued per host, hosts are served in
+    round-robin order, so a host with many sites can't starve other hosts.
+    Global rate is limited by token bucket. Global concurrency is checked
+    only when request is granted, so requests waiting for a busy host don't
+    occupy slots which could be used by other hosts.
+    """
+
+    def __init__(
+            self,
+            max_per_host: int = DEFAULT_MAX_PER_HOST,
+            rate_per_s: typing.Optional[float] = None,
+            burst: int = 1,
+            max_concurrent: typing.Optional[int] = None,
+    ):
+        """
+        Create throttle.
+
+        :param max_per_host: maximal number of simultaneous requests to the same host
+        :param rate_per_s: maximal global requests rate or None if not limited
+        :param burst: token bucket size, number of requests which can be sent at once
+        :param max_concurrent: maximal number of simultaneous requests to all
+            hosts or None if not limited
+
+        """
+        if max_per_host < 1:
+            raise ValueError(f"max_per_host should be positive, got {max_per_host}")
+        if rate_per_s is not None and rate_per_s <= 0:
+            raise ValueError(f"rate_per_s should be positive, got {rate_per_s}")
+        if max_concurrent is not None and max_concurrent < 1:
+            raise ValueError(f"max_concurrent should be positive, got {max_concurrent}")
+        self._max_per_host = max_per_host
+        self._max_concurrent = max_concurrent
+        self._active = 0
+        self._rate_per_s = rate_per_s
+        self._burst = max(burst, 1)
+        self._tokens = float(self._burst)
+        self._refill_time = time.monotonic()
+        self._hosts: typing.Dict[str, _HostState] = {}
+        self._ready_hosts: typing.Deque[str] = collections.deque()
+        self._timer: typing.Optional[asyncio.TimerHandle] = None
+
+    @contextlib.asynccontextmanager
+    async def slot(self, host: str) -> typing.AsyncIterator[float]:
+        """
+        Wait for the permission to send request to the host.
+
+        :returns: time spent waiting for the permission, in seconds
+
+        """
+        start = time.monotonic()
+        await self._acquire(host)
+        try:
+            yield time.monotonic() - start
+        finally:
+            self._release(host)
+
+    async def _acquire(self, host: str):
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = _HostState()
+        waiter = asyncio.get_event_loop().create_future()
+        state.waiters.append(waiter)
+        self._mark_ready(host, state)
+        self._dispatch()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release(host)
+            else:
+                self._dispatch()
+            raise
+
+    def _release(self, host: str):
+        self._active -= 1
+        state = self._hosts[host]
+        state.active -= 1
+        if not state.active and not state.waiters:
+            del self._hosts[host]
+        else:
+            self._mark_ready(host, state)
+        self._dispatch()
+
+    def _mark_ready(self, host: str, state: _HostState):
+        if not state.is_ready and state.waiters and state.active < self._max_per_host:
+            state.is_ready = True
+            self._ready_hosts.append(host)
+
+    def _take_token(self) -> bool:
+        if self._rate_per_s is None:
+            return True
+        now = time.monotonic()
+        self._tokens = min(
+            self._burst,
+            self._tokens + (now - self._refill_time) * self._rate_per_s,
+        )
+        self._refill_time = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    def _on_timer(self):
+        self._timer = None
+        self._dispatch()
+
+    def _dispatch(self):
+        while self._ready_hosts:
+            host = self._ready_hosts[0]
+            state = self._hosts[host]
+            while state.waiters and state.waiters[0].done():
+                state.waiters.popleft()
+            if not state.waiters:
+                self._ready_hosts.popleft()
+                state.is_ready = False
+                if not state.active:
+                    del self._hosts[host]
+                continue
+            if self._max_concurrent is not None and self._active >= self._max_concurrent:
+                return
+            if not self._take_token():
+                if self._timer is None:
+                    assert self._rate_per_s is not None
+                    self._timer = asyncio.get_event_loop().call_later(
+                        (1 - self._tokens) / self._rate_per_s, self._on_timer,
+                    )
+                return
+            self._ready_hosts.popleft()
+            state.is_ready = False
+            state.active += 1
+            self._active += 1
+            state.waiters.popleft().set_result(None)
+            self._mark_ready(host, state)
@@ -0,0 +1,129 @@
+import json
+import os
+
+import pytest
+
+from sitemon.catalog import (
+    apply_sites,
+    parse_sites,
+    reload_sites,
+    SiteConfig,
+    SitesFile,
+)
+from sitemon.common import CheckMode
+from sitemon.registry import SiteRegistry
+
+
+def test_parse_sites():
+    """Test sites descriptions are parsed using defaults."""
+    configs = parse_sites(
+        [
+            {'url': 'foo', 'interval': 10, 'match': 'bar', 'mode': 'conditional'},
+            {'url': 'foo'},
+            {'url': 'baz'},
+            {'url': 'foo', 'match': 'bar'},
+        ],
+        default_interval=5,
+        default_check_mode=CheckMode.Head,
+    )
+    assert configs == {
+        ('foo', 'bar'): SiteConfig(10, CheckMode.Conditional),
+        ('foo', ''): SiteConfig(5, CheckMode.Head),
+        ('baz', ''): SiteConfig(5, CheckMode.Head),
+    }
+
+
+def _get_indices(registry):
+    return {
+        (registry.get_url(index), registry.get_match(index)): index
+        for index in registry.iter_indices()
+    }
+
+
+def test_apply_sites(mocker, subtests):
+    """Test sites set changes are applied incrementally."""
+    mocker.patch('sitemon.catalog._monotonic_ms', return_value=1000)
+    mocker.patch('sitemon.catalog.random.uniform', return_value=0.5)
+    registry = SiteRegistry()
+
+    with subtests.test("New sites are added with jitter"):
+        removed = apply_sites(registry, {
+            ('foo', ''): SiteConfig(60, CheckMode.Get),
+            ('foo', 'x'): SiteConfig(60, CheckMode.Get),
+            ('bar', ''): SiteConfig(60, CheckMode.Get),
+            ('baz', ''): SiteConfig(60, CheckMode.Get),
+        })
+        assert removed == []
+        assert len(registry) == 4
+        indices = _get_indices(registry)
+        assert all(registry.get_due_ms(index) == 1500 for index in indices.values())
+
+    foo_index, foo_x = indices[('foo', '')], indices[('foo', 'x')]
+    bar_index, baz_index = indices[('bar', '')], indices[('baz', '')]
+    registry.set_status(foo_index, 200, 0.5, True)
+    registry.schedule(foo_index, 30000)
+    registry.schedule(foo_x, 30000)
+    registry.schedule(bar_index, 30000)
+    assert registry.pop_due(1500) == [baz_index]
+    baz_generation = registry.get_generation(baz_index)
+
+    removed = apply_sites(registry, {
+        ('foo', ''): SiteConfig(60, CheckMode.Conditional),
+        ('foo', 'y'): SiteConfig(60, CheckMode.Get),
+        ('bar', ''): SiteConfig(10, CheckMode.Get),
+        ('qux', ''): SiteConfig(60, CheckMode.Get),
+    })
+    indices = _get_indices(registry)
+
+    with subtests.test("Changed site is updated in place"):
+        assert indices[('foo', '')] == foo_index
+        assert registry.get_check_mode(foo_index) == CheckMode.Conditional
+        assert registry.get_status(foo_index) == (200, 0.5, True)
+        assert registry.get_due_ms(foo_index) == 30000
+
+    with subtests.test("Site with shorter interval is re-scheduled"):
+        assert registry.get_interval_s(bar_index) == 10
+        assert registry.get_due_ms(bar_index) == 1500
+
+    with subtests.test("Changed match means another site"):
+        assert ('foo', 'x') not in indices
+        assert registry.get_due_ms(indices[('foo', 'y')]) == 1500
+
+    with subtests.test("Removed sites are returned"):
+        assert sorted(removed) == [('baz', ''), ('foo', 'x')]
+
+    with subtests.test("Removed site being checked gets the new generation"):
+        assert len(registry) == 4
+        assert registry.get_generation(baz_index) != baz_generation
+
+    with subtests.test("New site is added"):
+        assert registry.get_due_ms(indices[('qux', '')]) == 1500
+
+
+@pytest.mark.asyncio
+async def test_sites_file(tmp_path, subtests):
+    """Test sites file is re-read only when modified."""
+    path = tmp_path / 'sites.json'
+    path.write_text(json.dumps({'sites': [{'url': 'foo'}]}))
+    source = SitesFile(str(path))
+    registry = SiteRegistry()
+
+    with subtests.test("Sites are loaded"):
+        await reload_sites(registry, source)
+        assert [registry.get_url(index) for index in registry.iter_indices()] == ['foo']
+
+    with subtests.test("Unmodified file is not parsed"):
+        assert await source.get_sites() is None
+
+    with subtests.test("Modified file is applied"):
+        path.write_text(json.dumps({'sites': [{'url': 'bar'}]}))
+        stat = path.stat()
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+        removed = []
+
+        async def on_removed(url, match):
+            removed.append((url, match))
+
+        await reload_sites(registry, source, on_removed)
+        assert [registry.get_url(index) for index in registry.iter_indices()] == ['bar']
+        assert removed == [('foo', '')]
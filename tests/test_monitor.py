@@ -1,33 +1,48 @@
+import asyncio
 from collections import namedtuple
-from dataclasses import asdict
-import datetime
+import time
 
+import httpx
 import pytest
 from asynctest import CoroutineMock  # type: ignore
 
 from sitemon.common import (
+    CheckMode,
+    HEARTBEAT_TOPIC_NAME,
+    SiteHeartbeat,
     SiteStatus,
     STATUS_TOPIC_NAME,
 )
 from sitemon.monitor import (
+    AuxHttpCode,
+    ChangeOnlyPublisher,
+    CheckContext,
     monitor_and_publish,
+    run_checks,
     _wait_until_passed,
 )
+from sitemon.registry import SiteRegistry
+from sitemon.throttle import RequestThrottle
+
+
+def make_response(mocker, text='', status_code=200, latency_s=0.5, headers=None):
+    """Create mock of HTTP response."""
+    response = mocker.Mock()
+    response.text = text
+    response.status_code = status_code
+    response.headers = headers or {}
+    response.elapsed.total_seconds = mocker.Mock(return_value=latency_s)
+    return response
 
 
 @pytest.mark.asyncio
-async def test_wait_until_passed(mocker, subtests):
+async def test_wait_until_passed(mocker):
     """Test wait logic."""
-    now = datetime.datetime.now()
-    plus_sec = now + datetime.timedelta(seconds=1)
-    now_mock = mocker.patch('sitemon.monitor._now')
+    now = 10_000_000_000
+    plus_sec = now + 1_000_000_000
+    now_mock = mocker.patch('sitemon.monitor._monotonic_ns')
     sleep_mock = mocker.patch('asyncio.sleep', CoroutineMock())
 
-    with subtests.test("Time moved back, shouldn't wait"):
-        now_mock.return_value = now - datetime.timedelta(seconds=1)
-        await _wait_until_passed(1, now)
-        sleep_mock.assert_not_called()
-
     now_mock.return_value = plus_sec
 
     await _wait_until_passed(-0.1, now)
@@ -54,7 +69,7 @@ async def test_monitor(mocker, subtests):
                 http_code=200,
                 match='',
                 is_match_found=True,
-                check_time_iso=mocker.ANY,
+                check_time_ns=mocker.ANY,
                 latency_s=1,
             ),
         ),
@@ -66,7 +81,7 @@ async def test_monitor(mocker, subtests):
                 http_code=200,
                 match=r'bar\w',
                 is_match_found=False,
-                check_time_iso=mocker.ANY,
+                check_time_ns=mocker.ANY,
                 latency_s=1,
             ),
         ),
@@ -78,7 +93,7 @@ async def test_monitor(mocker, subtests):
                 http_code=200,
                 match=r'bar +f',
                 is_match_found=True,
-                check_time_iso=mocker.ANY,
+                check_time_ns=mocker.ANY,
                 latency_s=1,
             ),
         ),
@@ -103,9 +118,9 @@ async def test_monitor(mocker, subtests):
         except Exception as err:  # pylint: disable=broad-except
             pytest.fail(err)
 
-        assert msg == asdict(expected_msg)
-        check_time = datetime.datetime.fromisoformat(status.check_time_iso)
-        assert isinstance(check_time, datetime.datetime)
+        assert msg == expected_msg._asdict()
+        assert isinstance(status.check_time_ns, int)
+        assert abs(status.check_time_ns - time.time_ns()) < 10_000_000_000
 
     http_get_mock = CoroutineMock(side_effect=get_http_response_mock)
 
@@ -114,10 +129,313 @@ async def test_monitor(mocker, subtests):
         with subtests.test(
                 msg="monitor_and_publish(): {}".format(explanation),
                 data=current_row):
-            start_date_time = await monitor_and_publish(
+            start_ns = await monitor_and_publish(
                 send_async=send_mock,
                 http_get_async=http_get_mock,
                 url=expected_msg.url,
                 match=expected_msg.match,
             )
-            assert isinstance(start_date_time, datetime.datetime)
+            assert isinstance(start_ns, int)
+
+
+@pytest.mark.asyncio
+async def test_request_errors(subtests):
+    """Test failed requests are published with auxiliary HTTP codes."""
+    request = httpx.Request('GET', 'foo')
+    data = [
+        (httpx.ConnectError('refused', request=request), AuxHttpCode.Down),
+        (httpx.ConnectTimeout('connect', request=request), AuxHttpCode.ConnectionTimeout),
+        (httpx.ReadTimeout('read', request=request), AuxHttpCode.Timeout),
+        (httpx.ReadError('reset', request=request), AuxHttpCode.Unknown),
+    ]
+    for error, http_code in data:
+        with subtests.test(msg=type(error).__name__):
+            send_mock = CoroutineMock()
+            await monitor_and_publish(
+                send_async=send_mock,
+                http_get_async=CoroutineMock(side_effect=error),
+                url='foo',
+            )
+            status = SiteStatus(**send_mock.call_args[0][1])
+            assert status.http_code == http_code
+            assert status.latency_s == -1
+
+
+@pytest.mark.asyncio
+async def test_change_only_publisher(subtests):
+    """Test only transitions and heartbeats are published in change-only mode."""
+
+    sent = []
+
+    async def send_mock(topic, msg):
+        sent.append((topic, msg))
+
+    publisher = ChangeOnlyPublisher(
+        send_mock, heartbeat_interval_s=10, latency_buckets_s=(1,),
+    )
+    start_ns = 1_577_836_800_000_000_000
+
+    def make_status(seconds, http_code=200, latency_s=0.5):
+        return SiteStatus(
+            url='foo',
+            http_code=http_code,
+            match='',
+            is_match_found=True,
+            check_time_ns=start_ns + seconds * 1_000_000_000,
+            latency_s=latency_s,
+        )
+
+    with subtests.test("First status is published"):
+        await publisher.send(STATUS_TOPIC_NAME, make_status(0)._asdict())
+        assert sent == [(STATUS_TOPIC_NAME, make_status(0)._asdict())]
+
+    with subtests.test("Same status in the same latency bucket is suppressed"):
+        sent.clear()
+        await publisher.send(STATUS_TOPIC_NAME, make_status(1, latency_s=0.1)._asdict())
+        await publisher.send(STATUS_TOPIC_NAME, make_status(2, latency_s=0.3)._asdict())
+        assert not sent
+
+    with subtests.test("Transition is published after heartbeat for suppressed checks"):
+        await publisher.send(STATUS_TOPIC_NAME, make_status(3, http_code=500)._asdict())
+        assert sent == [
+            (HEARTBEAT_TOPIC_NAME, SiteHeartbeat(
+                url='foo',
+                match='',
+                first_check_time_ns=make_status(1).check_time_ns,
+                last_check_time_ns=make_status(2).check_time_ns,
+                checks_count=2,
+                http_code=200,
+                is_match_found=True,
+                latency_min_s=0.1,
+                latency_max_s=0.3,
+                latency_mean_s=0.2,
+            )._asdict()),
+            (STATUS_TOPIC_NAME, make_status(3, http_code=500)._asdict()),
+        ]
+
+    with subtests.test("Latency bucket change is a transition"):
+        sent.clear()
+        await publisher.send(STATUS_TOPIC_NAME, make_status(4, 500, latency_s=2)._asdict())
+        assert sent == [(STATUS_TOPIC_NAME, make_status(4, 500, latency_s=2)._asdict())]
+
+    with subtests.test("Heartbeat is published when interval is passed"):
+        sent.clear()
+        for seconds in range(5, 14):
+            await publisher.send(STATUS_TOPIC_NAME, make_status(seconds, 500, 2)._asdict())
+        assert not sent
+        await publisher.send(STATUS_TOPIC_NAME, make_status(14, 500, 2)._asdict())
+        assert [topic for topic, _ in sent] == [HEARTBEAT_TOPIC_NAME]
+        assert sent[0][1]['checks_count'] == 10
+
+    with subtests.test("Flush publishes pending heartbeats"):
+        sent.clear()
+        await publisher.flush()
+        assert not sent
+        await publisher.send(STATUS_TOPIC_NAME, make_status(15, 500, 2)._asdict())
+        await publisher.flush()
+        assert [topic for topic, _ in sent] == [HEARTBEAT_TOPIC_NAME]
+        assert sent[0][1]['checks_count'] == 1
+
+    with subtests.test("Discarded site heartbeat is published and state is dropped"):
+        sent.clear()
+        await publisher.send(STATUS_TOPIC_NAME, make_status(16, 500, 2)._asdict())
+        await publisher.discard('foo', '')
+        assert [topic for topic, _ in sent] == [HEARTBEAT_TOPIC_NAME]
+        await publisher.discard('foo', '')
+        await publisher.send(STATUS_TOPIC_NAME, make_status(17, 500, 2)._asdict())
+        assert [topic for topic, _ in sent] == [HEARTBEAT_TOPIC_NAME, STATUS_TOPIC_NAME]
+
+
+@pytest.mark.asyncio
+async def test_run_checks(mocker):
+    """Test all due registered sites are checked and re-scheduled."""
+    mocker.patch('sitemon.monitor._monotonic_ms', return_value=1000)
+    registry = SiteRegistry()
+    foo_index = registry.add('foo', 1, due_ms=0)
+    bar_index = registry.add('bar', 2, match='bar', due_ms=1000)
+    baz_index = registry.add('baz', 1, due_ms=2000)
+
+    send_mock = CoroutineMock()
+    await run_checks(
+        registry=registry,
+        send_async=send_mock,
+        http_get_async=CoroutineMock(side_effect=lambda url: make_response(mocker, url)),
+        is_stop_loop=lambda: True,
+    )
+    assert sorted(args[1]['url'] for args, _ in send_mock.call_args_list) == ['bar', 'foo']
+    assert registry.get_status(foo_index) == (200, 0.5, True)
+    assert registry.get_status(bar_index) == (200, 0.5, True)
+    assert registry.pop_due(3000) == [foo_index, baz_index, bar_index]
+
+
+@pytest.mark.asyncio
+async def test_run_checks_removed_site(mocker):
+    """Test state of the site removed while being checked is forgotten."""
+    registry = SiteRegistry()
+    foo_index = registry.add('foo', 1)
+
+    async def get_http_response_mock(url):
+        registry.remove(foo_index)
+        registry.add('bar', 1, match='bar', due_ms=10 ** 12)
+        return make_response(mocker, url)
+
+    on_forget = CoroutineMock()
+    await run_checks(
+        registry=registry,
+        send_async=CoroutineMock(),
+        http_get_async=get_http_response_mock,
+        context=CheckContext(on_forget=on_forget),
+        is_stop_loop=lambda: True,
+    )
+    on_forget.assert_called_once_with('foo', '')
+    assert registry.get_url(foo_index) == 'bar'
+    assert registry.get_status(foo_index) == (0, 0, False)
+
+
+@pytest.mark.asyncio
+async def test_run_checks_throttled(mocker):
+    """Test sites on a busy host don't delay checks of other hosts."""
+    registry = SiteRegistry()
+    for index in range(20):
+        registry.add(f'https://cdn/{index}', 60)
+    registry.add('https://other/', 60)
+
+    async def get_http_response_mock(url):
+        await asyncio.sleep(0.02)
+        return make_response(mocker, url, latency_s=0.02)
+
+    send_mock = CoroutineMock()
+    await run_checks(
+        registry=registry,
+        send_async=send_mock,
+        http_get_async=get_http_response_mock,
+        context=CheckContext(throttle=RequestThrottle(max_per_host=1, max_concurrent=4)),
+        is_stop_loop=lambda: True,
+    )
+    statuses = {
+        status.url: status
+        for status in (SiteStatus(**args[1]) for args, _ in send_mock.call_args_list)
+    }
+    assert len(statuses) == 21
+    assert statuses['https://other/'].schedule_delay_s < 0.1
+    assert statuses['https://cdn/19'].schedule_delay_s > 0.3
+
+
+@pytest.mark.asyncio
+async def test_head_mode(mocker, subtests):
+    """Test HEAD check mode."""
+
+    send_mock = CoroutineMock()
+
+    def get_sent_status():
+        return SiteStatus(**send_mock.call_args[0][1])
+
+    with subtests.test("HEAD is used if there is nothing to search"):
+        http_get_mock = CoroutineMock()
+        http_head_mock = CoroutineMock(return_value=make_response(mocker))
+        await monitor_and_publish(
+            send_async=send_mock,
+            http_get_async=http_get_mock,
+            url='foo',
+            check_mode=CheckMode.Head,
+            context=CheckContext(http_head_async=http_head_mock),
+        )
+        http_get_mock.assert_not_called()
+        http_head_mock.assert_called_once_with('foo')
+        assert get_sent_status().check_mode == CheckMode.Head.value
+        assert get_sent_status().is_match_found
+
+    with subtests.test("GET is used instead of HEAD if there is something to search"):
+        http_get_mock = CoroutineMock(return_value=make_response(mocker, 'bar'))
+        http_head_mock = CoroutineMock()
+        await monitor_and_publish(
+            send_async=send_mock,
+            http_get_async=http_get_mock,
+            url='foo',
+            match='bar',
+            check_mode=CheckMode.Head,
+            context=CheckContext(http_head_async=http_head_mock),
+        )
+        http_head_mock.assert_not_called()
+        assert get_sent_status().check_mode == CheckMode.Get.value
+
+    with subtests.test("GET is used if HEAD is not supported"):
+        context = CheckContext()
+        for status_code in (405, 501):
+            http_get_mock = CoroutineMock(return_value=make_response(mocker))
+            context.http_head_async = CoroutineMock(
+                return_value=make_response(mocker, status_code=status_code),
+            )
+            await monitor_and_publish(
+                send_async=send_mock,
+                http_get_async=http_get_mock,
+                url=f'foo{status_code}',
+                check_mode=CheckMode.Head,
+                context=context,
+            )
+            http_get_mock.assert_called_once_with(f'foo{status_code}')
+            assert get_sent_status().http_code == 200
+            assert get_sent_status().check_mode == CheckMode.Get.value
+        assert context.head_unsupported == {'foo405', 'foo501'}
+
+    with subtests.test("HEAD is not tried again for the site which does not support it"):
+        context.http_head_async = CoroutineMock()
+        await monitor_and_publish(
+            send_async=send_mock,
+            http_get_async=CoroutineMock(return_value=make_response(mocker)),
+            url='foo405',
+            check_mode=CheckMode.Head,
+            context=context,
+        )
+        context.http_head_async.assert_not_called()
+        assert get_sent_status().check_mode == CheckMode.Get.value
+
+    with subtests.test("HEAD is tried again for the forgotten site"):
+        await context.forget('foo405', '')
+        assert context.head_unsupported == {'foo501'}
+
+
+@pytest.mark.asyncio
+async def test_conditional_mode(mocker, subtests):
+    """Test conditional GET check mode."""
+
+    send_mock = CoroutineMock()
+    context = CheckContext()
+    http_get_mock = CoroutineMock()
+
+    async def check_conditional():
+        await monitor_and_publish(
+            send_async=send_mock,
+            http_get_async=http_get_mock,
+            url='foo',
+            match='bar',
+            check_mode=CheckMode.Conditional,
+            context=context,
+        )
+        return SiteStatus(**send_mock.call_args[0][1])
+
+    with subtests.test("Validators are cached from the full response"):
+        http_get_mock.return_value = make_response(mocker, 'bar', headers={'etag': '"1"'})
+        status = await check_conditional()
+        http_get_mock.assert_called_once_with('foo')
+        assert status.check_mode == CheckMode.Conditional.value
+        assert status.is_match_found
+
+    with subtests.test("Previous search result is reused on 304"):
+        http_get_mock.reset_mock()
+        http_get_mock.return_value = make_response(mocker, status_code=304)
+        status = await check_conditional()
+        http_get_mock.assert_called_once_with('foo', headers={'If-None-Match': '"1"'})
+        assert status.http_code == 304
+        assert status.is_match_found
+
+    with subtests.test("Modified page is searched again"):
+        http_get_mock.return_value = make_response(mocker, 'baz')
+        assert not (await check_conditional()).is_match_found
+        assert context.conditional_cache.get('foo', 'bar') is None
+
+    with subtests.test("Validators of the forgotten site are dropped"):
+        http_get_mock.return_value = make_response(mocker, 'bar', headers={'etag': '"2"'})
+        await check_conditional()
+        await context.forget('foo', 'bar')
+        assert context.conditional_cache.get('foo', 'bar') is None
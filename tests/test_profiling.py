@@ -0,0 +1,65 @@
+import argparse
+import asyncio
+import logging
+import time
+
+import pytest
+
+from sitemon.profiling import (
+    add_profile_arguments,
+    get_profile_options,
+    profile_context,
+    ProfileOptions,
+)
+
+
+@pytest.mark.asyncio
+async def test_profile_context(caplog, tmp_path, subtests):
+    """Test loop lag and slow callbacks are detected."""
+
+    dump_path = tmp_path / 'profile.txt'
+    options = ProfileOptions(
+        lag_sample_interval_s=0.01,
+        slow_callback_s=0.05,
+        dump_path=str(dump_path),
+        sampling_interval_s=0.005,
+    )
+
+    def block_loop():
+        time.sleep(0.2)
+
+    with subtests.test("Profiling is off"):
+        async with profile_context(None) as lag_monitor:
+            assert lag_monitor is None
+
+    with caplog.at_level(logging.WARNING, logger='sitemon.profiling'):
+        async with profile_context(options) as lag_monitor:
+            await asyncio.sleep(0.05)
+            mark = lag_monitor.get_mark()
+            assert lag_monitor.get_max_lag_s(mark) == 0
+            block_loop()
+            await asyncio.sleep(0.05)
+            lag_s = lag_monitor.get_max_lag_s(mark)
+
+    with subtests.test("Loop lag is measured"):
+        assert 0.1 < lag_s < 1
+
+    with subtests.test("Slow callback is reported with stack"):
+        assert any(
+            'Event loop is blocked' in record.message and 'block_loop' in record.message
+            for record in caplog.records
+        )
+
+    with subtests.test("Sampled stacks are dumped"):
+        assert 'block_loop' in dump_path.read_text()
+
+
+def test_profile_arguments(subtests):
+    """Test profiling intervals should be positive."""
+    parser = argparse.ArgumentParser()
+    add_profile_arguments(parser)
+    options = get_profile_options(parser.parse_args(['--profile', '--slow-callback-ms', '20']))
+    assert options and options.slow_callback_s == 0.02
+    for name in ('--slow-callback-ms', '--profile-dump-interval'):
+        with subtests.test(name), pytest.raises(SystemExit):
+            parser.parse_args(['--profile', name, '0'])
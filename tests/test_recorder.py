@@ -0,0 +1,157 @@
+import asyncio
+import contextlib
+
+import pytest
+from asynctest import CoroutineMock  # type: ignore
+
+from sitemon.common import (
+    HEARTBEAT_TOPIC_NAME,
+    SiteHeartbeat,
+    SiteStatus,
+    STATUS_TOPIC_NAME,
+)
+from sitemon.recorder import (
+    QueueRecorder,
+    store_messages,
+)
+
+
+def _make_status(url):
+    return SiteStatus(
+        url=url,
+        check_time_ns=1_577_836_800_000_000_000,
+        http_code=200,
+        latency_s=0.5,
+        match='',
+        is_match_found=True,
+    )
+
+
+def _make_site_state_mock(mocker):
+    site_state = mocker.Mock()
+    site_state.insert_site_status = CoroutineMock()
+    site_state.insert_site_statuses = CoroutineMock()
+    site_state.insert_site_heartbeat = CoroutineMock()
+    site_state.insert_site_heartbeats = CoroutineMock()
+    return site_state
+
+
+@pytest.mark.asyncio
+async def test_store_messages(mocker):
+    """Test statuses and heartbeats are stored to the corresponding tables."""
+    site_state = _make_site_state_mock(mocker)
+    heartbeat = SiteHeartbeat(
+        url='foo',
+        match='',
+        first_check_time_ns=1_577_836_800_000_000_000,
+        last_check_time_ns=1_577_836_860_000_000_000,
+        checks_count=2,
+        http_code=200,
+        is_match_found=True,
+        latency_min_s=0.1,
+        latency_max_s=0.2,
+        latency_mean_s=0.15,
+    )
+    await store_messages(site_state, [
+        (STATUS_TOPIC_NAME, _make_status('foo')._asdict()),
+        (HEARTBEAT_TOPIC_NAME, heartbeat._asdict()),
+        (STATUS_TOPIC_NAME, _make_status('bar')._asdict()),
+    ])
+    site_state.insert_site_statuses.assert_called_once_with(
+        [_make_status('foo'), _make_status('bar')]
+    )
+    site_state.insert_site_heartbeat.assert_called_once_with(heartbeat)
+
+
+@pytest.mark.asyncio
+async def test_store_legacy_messages(mocker):
+    """Test messages with ISO date/time from older monitors are accepted."""
+    site_state = _make_site_state_mock(mocker)
+    data = _make_status('foo')._asdict()
+    del data['check_time_ns']
+    data['check_time_iso'] = '2020-01-01T00:00:00+00:00'
+    await store_messages(site_state, [(STATUS_TOPIC_NAME, data)])
+    site_state.insert_site_status.assert_called_once_with(_make_status('foo'))
+
+
+@pytest.mark.asyncio
+async def test_queue_recorder(mocker, subtests):
+    """Test queued messages are stored in batches with backpressure."""
+    site_state = _make_site_state_mock(mocker)
+    queue_recorder = QueueRecorder(max_queue_size=2, max_batch_size=2)
+    urls = ['a', 'b', 'c', 'd', 'e']
+
+    with subtests.test("Sender waits while queue is full"):
+        for url in urls[:2]:
+            await queue_recorder.send(STATUS_TOPIC_NAME, _make_status(url)._asdict())
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(
+                queue_recorder.send(STATUS_TOPIC_NAME, _make_status('c')._asdict()), 0.01,
+            )
+
+    record_task = asyncio.create_task(queue_recorder.run(site_state))
+    for url in urls[2:]:
+        await queue_recorder.send(STATUS_TOPIC_NAME, _make_status(url)._asdict())
+    await asyncio.wait_for(queue_recorder.join(), 1)
+    record_task.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await record_task
+
+    with subtests.test("All messages are stored in batches"):
+        stored = [
+            status.url
+            for call in site_state.insert_site_statuses.call_args_list
+            for status in call[0][0]
+        ] + [call[0][0].url for call in site_state.insert_site_status.call_args_list]
+        assert sorted(stored) == urls
+        assert site_state.insert_site_statuses.call_count >= 1
+
+
+@pytest.mark.asyncio
+async def test_queue_recorder_failure(mocker, subtests):
+    """Test senders are stopped instead of waiting forever if storing fails."""
+    site_state = _make_site_state_mock(mocker)
+    site_state.insert_site_status.side_effect = RuntimeError('DB is down')
+    site_state.insert_site_statuses.side_effect = RuntimeError('DB is down')
+    queue_recorder = QueueRecorder(max_queue_size=3, max_batch_size=2)
+    is_sender_cancelled = False
+
+    async def send_forever():
+        nonlocal is_sender_cancelled
+        try:
+            while True:
+                await queue_recorder.send(STATUS_TOPIC_NAME, _make_status('foo')._asdict())
+        except asyncio.CancelledError:
+            is_sender_cancelled = True
+            raise
+
+    with subtests.test("Storing error is raised"):
+        with pytest.raises(RuntimeError, match='DB is down'):
+            await asyncio.wait_for(
+                queue_recorder.run_until_complete(site_state, send_forever()), 1,
+            )
+
+    with subtests.test("Sender is cancelled"):
+        assert is_sender_cancelled
+
+
+@pytest.mark.asyncio
+async def test_queue_recorder_complete(mocker):
+    """Test all sent messages are stored before completion."""
+    site_state = _make_site_state_mock(mocker)
+    queue_recorder = QueueRecorder(max_queue_size=3, max_batch_size=2)
+
+    async def send_some():
+        for url in 'abcde':
+            await queue_recorder.send(STATUS_TOPIC_NAME, _make_status(url)._asdict())
+        return 'done'
+
+    assert await asyncio.wait_for(
+        queue_recorder.run_until_complete(site_state, send_some()), 1,
+    ) == 'done'
+    stored = [
+        status.url
+        for call in site_state.insert_site_statuses.call_args_list
+        for status in call[0][0]
+    ] + [call[0][0].url for call in site_state.insert_site_status.call_args_list]
+    assert sorted(stored) == list('abcde')
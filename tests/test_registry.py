@@ -0,0 +1,83 @@
+from sitemon.registry import (
+    NOT_SCHEDULED,
+    SiteRegistry,
+    StringPool,
+)
+
+
+def test_string_pool(subtests):
+    """Test strings are interned and released."""
+    pool = StringPool()
+    foo_id = pool.add('foo')
+    bar_id = pool.add('bar')
+
+    with subtests.test("Strings are interned"):
+        assert bar_id != foo_id
+        assert pool.add('foo') == foo_id
+        assert pool[foo_id] == 'foo'
+        assert len(pool) == 2
+
+    with subtests.test("String is removed when all references are released"):
+        pool.release(foo_id)
+        assert pool[foo_id] == 'foo'
+        pool.release(foo_id)
+        assert len(pool) == 1
+
+    with subtests.test("Id of removed string is reused"):
+        assert pool.add('baz') == foo_id
+        assert pool[foo_id] == 'baz'
+        assert pool.add('foo') not in (foo_id, bar_id)
+
+
+def test_registry(subtests):
+    """Test sites registration and scheduling."""
+    registry = SiteRegistry()
+    foo_index = registry.add('http://foo', 1.5, due_ms=10)
+    bar_index = registry.add('http://bar', 60, match='bar', due_ms=5)
+
+    with subtests.test("Site metadata is stored"):
+        assert len(registry) == 2
+        assert registry.get_url(foo_index) == 'http://foo'
+        assert registry.get_match(foo_index) == ''
+        assert registry.get_interval_s(foo_index) == 1.5
+        assert registry.get_match(bar_index) == 'bar'
+        assert registry.get_status(bar_index) == (0, 0, False)
+
+    with subtests.test("Status is stored"):
+        registry.set_status(bar_index, 200, 0.5, True)
+        assert registry.get_status(bar_index) == (200, 0.5, True)
+
+    with subtests.test("Due sites are popped in order"):
+        assert registry.get_next_due_ms() == 5
+        assert registry.pop_due(4) == []
+        assert registry.pop_due(10) == [bar_index, foo_index]
+        assert registry.get_next_due_ms() is None
+
+    with subtests.test("Rescheduling replaces previous due time"):
+        registry.schedule(foo_index, 20)
+        registry.schedule(foo_index, 30)
+        assert registry.get_next_due_ms() == 30
+        assert registry.pop_due(25) == []
+        assert registry.pop_due(30) == [foo_index]
+
+    with subtests.test("Removed site is not scheduled and index is reused"):
+        registry.schedule(bar_index, 40)
+        registry.remove(bar_index)
+        assert len(registry) == 1
+        assert registry.get_next_due_ms() is None
+        baz_index = registry.add('http://baz', 10, due_ms=NOT_SCHEDULED)
+        assert baz_index == bar_index
+        assert registry.get_url(baz_index) == 'http://baz'
+        assert registry.get_status(baz_index) == (0, 0, False)
+        assert registry.get_due_ms(baz_index) == NOT_SCHEDULED
+        assert registry.pop_due(100) == []
+        registry.schedule(baz_index, 0)
+        assert registry.pop_due(0) == [baz_index]
+
+    with subtests.test("Repeated removal does not free index twice"):
+        registry.remove(baz_index)
+        registry.remove(baz_index)
+        assert len(registry) == 1
+        assert registry.add('http://qux', 10) == baz_index
+        assert registry.add('http://quux', 10) != baz_index
+        assert len(registry) == 3
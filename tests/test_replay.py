@@ -0,0 +1,169 @@
+import json
+import time
+
+import pytest
+from asynctest import CoroutineMock  # type: ignore
+
+from sitemon.common import (
+    SiteStatus,
+    STATUS_TOPIC_NAME,
+)
+from sitemon.replay import (
+    _parse_args,
+    find_saturation_rate,
+    generate_statuses,
+    get_url_pattern,
+    measure_clock_offset,
+    publish_at_rate,
+    read_capture,
+    ReplayOptions,
+    run_steps,
+    StepResult,
+)
+
+
+def test_generate_statuses(subtests):
+    """Test synthetic statuses distribution."""
+    statuses = generate_statuses('p/', site_count=10, error_rate=0.1, seed=1)
+    messages = [SiteStatus(**next(statuses)) for _ in range(10000)]
+
+    with subtests.test("Sites are cycled"):
+        assert [status.url for status in messages[:11]] == [
+            f"p/{index}" for index in list(range(10)) + [0]
+        ]
+
+    with subtests.test("Errors are generated with the requested rate"):
+        errors = sum(status.http_code == 500 for status in messages)
+        assert 800 < errors < 1200
+
+    with subtests.test("Latency median is close to the requested one"):
+        latencies = sorted(status.latency_s for status in messages)
+        assert 0.18 < latencies[len(latencies) // 2] < 0.22
+
+
+def test_read_capture(tmp_path):
+    """Test captured statuses are replayed in a loop with prefixed URLs."""
+    path = tmp_path / 'capture.ndjson'
+    path.write_text(
+        json.dumps({'url': 'foo', 'check_time_iso': '2020-01-01T00:00:00'}) + '\n\n'
+        + json.dumps({'url': 'bar', 'check_time_ns': 1}) + '\n'
+    )
+    messages = read_capture(str(path), 'p/')
+    assert [next(messages) for _ in range(3)] == [
+        {'url': 'p/foo'}, {'url': 'p/bar', 'check_time_ns': 1}, {'url': 'p/foo'},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_publish_at_rate():
+    """Test messages are published at the target rate and stamped with time."""
+    send_mock = CoroutineMock()
+    messages = generate_statuses('p/', site_count=1)
+    start_ns = time.time_ns()
+    start = time.monotonic()
+    sent = await publish_at_rate(send_mock, messages, rate=100, duration_s=0.2)
+    elapsed_s = time.monotonic() - start
+    assert sent == 20
+    assert 0.15 < elapsed_s < 0.5
+    assert send_mock.call_count == 20
+    topic, data = send_mock.call_args[0]
+    assert topic == STATUS_TOPIC_NAME
+    assert data['check_time_ns'] >= start_ns
+
+
+@pytest.mark.asyncio
+async def test_measure_clock_offset(mocker):
+    """Test offset of the server clock is measured by the fastest request."""
+    offset_ns = 3_600_000_000_000
+    stats_db = mocker.Mock()
+    stats_db.get_time_ns = CoroutineMock(side_effect=lambda: time.time_ns() + offset_ns)
+    measured_ns, error_ns = await measure_clock_offset(stats_db)
+    assert abs(measured_ns - offset_ns) <= error_ns + 1_000_000
+    assert stats_db.get_time_ns.call_count > 1
+
+
+@pytest.mark.asyncio
+async def test_publish_with_clock_offset():
+    """Test check time is reported by the server clock."""
+    send_mock = CoroutineMock()
+    offset_ns = -3_600_000_000_000
+    await publish_at_rate(
+        send_mock, generate_statuses('p/', site_count=1), rate=100, duration_s=0.01,
+        clock_offset_ns=offset_ns,
+    )
+    check_time_ns = send_mock.call_args[0][1]['check_time_ns']
+    assert abs(check_time_ns - offset_ns - time.time_ns()) < 1_000_000_000
+
+
+def test_get_url_pattern():
+    """Test LIKE wildcards in the prefix are escaped."""
+    assert get_url_pattern('https://p_1/%') == r'https://p\_1/\%%'
+
+
+def _make_result(target_rate, rows_rate, lag_p99_s=0.1, rows=100):
+    return StepResult(
+        target_rate=target_rate,
+        sent=100,
+        publish_rate=target_rate,
+        rows=rows,
+        rows_rate=rows_rate,
+        lag_p50_s=0.01,
+        lag_p90_s=0.05,
+        lag_p99_s=lag_p99_s,
+        lag_max_s=lag_p99_s,
+    )
+
+
+def test_find_saturation_rate(subtests):
+    """Test the first not sustained rate is found."""
+    with subtests.test("All rates are sustained"):
+        assert find_saturation_rate([_make_result(100, 99), _make_result(200, 198)]) is None
+
+    with subtests.test("Recording rate is lower than target"):
+        assert find_saturation_rate([_make_result(100, 99), _make_result(200, 150)]) == 200
+
+    with subtests.test("Lag is too big"):
+        assert find_saturation_rate([_make_result(100, 99, lag_p99_s=2)]) == 100
+
+    with subtests.test("Not all statuses are recorded"):
+        assert find_saturation_rate([_make_result(100, 99, rows=90)]) == 100
+
+
+@pytest.mark.asyncio
+async def test_run_steps(mocker):
+    """Test recording statistics are collected for each rate."""
+    stats_db = mocker.Mock()
+    stats_db.get_last_state_id = CoroutineMock(return_value=42)
+    stats_db.get_record_stats = CoroutineMock(side_effect=lambda *_: {
+        'rows': 10,
+        'last_record_s': time.time(),
+        'lag_s': [0.01, 0.02, 0.03],
+        'max_lag_s': 0.04,
+    })
+    results = await run_steps(
+        send_async=CoroutineMock(),
+        flush_async=CoroutineMock(),
+        stats_db=stats_db,
+        messages=generate_statuses('https://p_1/', site_count=1),
+        options=ReplayOptions(
+            url_prefix='https://p_1/',
+            rates=[100],
+            step_duration_s=0.1,
+            drain_timeout_s=1,
+        ),
+    )
+    assert stats_db.get_record_stats.call_args[0][:2] == (r'https://p\_1/%', 42)
+    assert len(results) == 1
+    assert results[0].sent == 10
+    assert results[0].rows == 10
+    assert results[0].lag_p99_s == 0.03
+    assert results[0].is_sustained()
+
+
+def test_parse_args_positive(subtests):
+    """Test sizes and synthetic statuses parameters should be positive."""
+    for name in ('--sites', '--latency-median', '--queue-size', '--batch-size'):
+        with subtests.test(name):
+            assert _parse_args(['--db-conn', 'conn.json', name, '1', 'db.json'])
+            with pytest.raises(SystemExit):
+                _parse_args(['--db-conn', 'conn.json', name, '0', 'db.json'])
@@ -0,0 +1,116 @@
+import asyncio
+
+import pytest
+
+from sitemon.throttle import RequestThrottle
+
+
+@pytest.mark.asyncio
+async def test_max_per_host(subtests):
+    """Test concurrency limit per host and fair queuing across hosts."""
+    throttle = RequestThrottle(max_per_host=1)
+    order = []
+    release = asyncio.Event()
+
+    async def request(host, name):
+        async with throttle.slot(host) as delay_s:
+            order.append(name)
+            await release.wait()
+        return delay_s
+
+    tasks = [
+        asyncio.create_task(request(host, f"{host}{i}"))
+        for host, count in (('a', 3), ('b', 1))
+        for i in range(count)
+    ]
+    await asyncio.sleep(0.01)
+
+    with subtests.test("Only one request per host is running"):
+        assert order == ['a0', 'b0']
+
+    release.set()
+    delays = await asyncio.gather(*tasks)
+
+    with subtests.test("All requests are done"):
+        assert order == ['a0', 'b0', 'a1', 'a2']
+
+    with subtests.test("Waiting time is reported"):
+        assert delays[0] < 0.01
+        assert delays[1] >= 0.01
+
+
+@pytest.mark.asyncio
+async def test_rate_limit(subtests):
+    """Test global rate limit is shared by hosts in round-robin order."""
+    throttle = RequestThrottle(max_per_host=10, rate_per_s=50, burst=2)
+    order = []
+
+    async def request(host):
+        async with throttle.slot(host):
+            order.append(host)
+
+    loop = asyncio.get_event_loop()
+    start = loop.time()
+    await asyncio.gather(*(
+        [request('a') for _ in range(4)]
+        + [request('b') for _ in range(2)]
+    ))
+    elapsed_s = loop.time() - start
+
+    with subtests.test("Burst is sent at once, the rest is rate limited"):
+        assert 0.07 < elapsed_s < 0.5
+
+    with subtests.test("Hosts are served in turn"):
+        assert order == ['a', 'a', 'a', 'b', 'a', 'b']
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter():
+    """Test cancelled waiting request does not hold the slot."""
+    throttle = RequestThrottle(max_per_host=1)
+
+    async def wait_slot():
+        async with throttle.slot('a'):
+            pass
+
+    async with throttle.slot('a'):
+        waiting = asyncio.create_task(wait_slot())
+        await asyncio.sleep(0)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+    async with throttle.slot('a') as delay_s:
+        assert delay_s < 0.01
+
+
+@pytest.mark.asyncio
+async def test_max_concurrent(subtests):
+    """Test requests waiting for a busy host don't hold global concurrency slots."""
+    throttle = RequestThrottle(max_per_host=1, max_concurrent=2)
+    order = []
+    release = asyncio.Event()
+
+    async def request(host, name):
+        async with throttle.slot(host):
+            order.append(name)
+            await release.wait()
+
+    tasks = [asyncio.create_task(request('a', f"a{i}")) for i in range(3)]
+    tasks += [asyncio.create_task(request(host, host)) for host in ('b', 'c')]
+    await asyncio.sleep(0.01)
+
+    with subtests.test("Other host gets the free slot"):
+        assert order == ['a0', 'b']
+
+    release.set()
+    await asyncio.gather(*tasks)
+
+    with subtests.test("All requests are done"):
+        assert sorted(order) == ['a0', 'a1', 'a2', 'b', 'c']
+
+
+def test_invalid_limits():
+    """Test limits which would block requests forever are rejected."""
+    for kwargs in ({'max_per_host': 0}, {'rate_per_s': 0}, {'max_concurrent': 0}):
+        with pytest.raises(ValueError):
+            RequestThrottle(**kwargs)